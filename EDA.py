@@ -49,7 +49,7 @@ def run_initial_eda(prep):
     plt.show()
 
     #Heatmap of deaths by cause and year
-    pivot = df.pivot_table(index="Cause", columns="Year", values="Deaths", aggfunc="sum")
+    pivot = df.pivot_table(index="Cause", columns="Year", values="Deaths", aggfunc="sum", observed=True)
     pivot["mean"] = pivot.mean(axis=1)
     pivot = pivot.sort_values(by="mean", ascending=False).drop(columns="mean")
     plt.figure(figsize=(14, 10))
@@ -3,11 +3,10 @@ Copyright C Philipp Mc Guire, 2025
 Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html 
 """
 
-import pandas as pd
-import geopandas as gpd
-from shapely.geometry import mapping, Polygon, MultiPolygon
+import numpy as np
 
 from bokeh.io import curdoc
+from bokeh.events import RangesUpdate
 from bokeh.models import Select, ColorBar, LinearColorMapper, HoverTool, ColumnDataSource
 from bokeh.layouts import row, column
 from bokeh.plotting import figure
@@ -15,79 +14,57 @@ from bokeh.palettes import OrRd9
 from bokeh.models import Slider
 from bokeh.models import BasicTicker, PrintfTickFormatter
 from bokeh.models import LinearColorMapper
+from bokeh.models import Button
 
-# Load data
-death_df = pd.read_csv("cause_of_deaths.csv")
-pop_df = pd.read_csv("WPP2024_Population1JanuaryByAge5GroupSex_Medium.csv", low_memory=False)
-
-# Prepare population 
-pop_df = pop_df[(pop_df["Variant"] == "Medium") & (pop_df["Time"].between(1990, 2019))]
-pop_df = pop_df[pop_df["LocTypeID"] == 4] 
-pop_df = pop_df[["Location", "Time", "PopTotal"]]
-pop_df.columns = ["country", "Year", "Population_Total"]
-
-# Multiply by 1000 (data is in thousands)
-pop_df["Population_Total"] *= 1000
-
-# Group to get single value per country-year
-pop_df = pop_df.groupby(["country", "Year"], as_index=False)["Population_Total"].sum()
-#print(pop_df)
-
-# Prepare death data
-death_df = death_df.rename(columns={"Country/Territory": "country"})
-cause_cols = death_df.columns.difference(["country", "Year", "Code"])
-death_long = death_df.melt(id_vars=["country", "Year"], value_vars=cause_cols, var_name="Cause", value_name="Deaths")
-death_long["Deaths"] = pd.to_numeric(death_long["Deaths"], errors="coerce")
-merged = death_long.merge(pop_df, on=["country", "Year"], how="left")
-merged = merged[merged["Population_Total"].notna() & (merged["Population_Total"] > 0)]
-merged = merged[merged["Deaths"].notna()]
-merged["Death_Rate_per_100k"] = (merged["Deaths"] / merged["Population_Total"]) * 100000
-#print(merged)
-
-
-# Load world shapes
-world = gpd.read_file("data/ne_110m_admin_0_countries/ne_110m_admin_0_countries.shp")
-world = world.rename(columns={"ADMIN": "country"})
-world = world.to_crs("EPSG:4326")
-
-# Utility function to extract x/y from geometry
-def geo_to_coords(gdf):
-    xs, ys, countries, rates = [], [], [], []
-    for _, row in gdf.iterrows():
-        geom = row.geometry
-        if isinstance(geom, Polygon):
-            coords = [geom.exterior.coords]
-        elif isinstance(geom, MultiPolygon):
-            coords = [p.exterior.coords for p in geom.geoms]
-        else:
-            continue
-
-        for ring in coords:
-            x, y = zip(*ring)
-            xs.append(list(x))
-            ys.append(list(y))
-            countries.append(row["country"])
-            rates.append(row["Death_Rate_per_100k"])
-    return ColumnDataSource(data={"x": xs, "y": ys, "country": countries, "Death_Rate_per_100k": rates})
+from map_data import load_map_data, load_frame_cache
+from geometry import choose_level
 
-# Widgets
-cause_options = sorted(merged["Cause"].unique().tolist())
-year_options = sorted(merged["Year"].unique().tolist())
-cause_select = Select(title="Cause of Death", value="Tuberculosis", options=cause_options)
-year_slider = Slider(title="Year", start=min(year_options), end=max(year_options), step=1, value=2019)
+# Use 2nd-98th percentile color ranges instead of min/max
+ROBUST_COLORS = False
 
-# Initial data
-initial_df = merged[(merged["Cause"] == "Tuberculosis") & (merged["Year"] == 2019)]
-initial_geo = world.merge(initial_df, on="country", how="left").dropna(subset=["Death_Rate_per_100k", "geometry"])
-source = geo_to_coords(initial_geo)
+# Prepared data and geometry are loaded once per server process and shared by all sessions
+data = load_map_data()
+frames = load_frame_cache(robust=ROBUST_COLORS)
 
-# Color mapper
+# Widgets
+cause_select = Select(title="Cause of Death", value="Tuberculosis", options=data.causes)
+year_slider = Slider(title="Year", start=min(data.years), end=max(data.years), step=1, value=2019)
+
+PLOT_WIDTH = 1200
+
+# Geometry on screen: level of detail, visible patches and the country of each
+source = ColumnDataSource(data={"x": [], "y": [], "country": [], "Death_Rate_per_100k": []})
+view = {"level": None, "patches": None, "patch_country": None}
+
+def set_view(x0, x1, y0, y1):
+    # Pick the level of detail for the visible span and send only patches inside the view
+    level = choose_level(data.levels, x1 - x0, PLOT_WIDTH)
+    visible = level.visible(x0, x1, y0, y1)
+    if level is view["level"] and np.array_equal(visible, view["patches"]):
+        return
+
+    patch_country = level.patch_country[visible]
+    view.update(level=level, patches=visible, patch_country=patch_country)
+    rates = frames.get(cause_select.value, year_slider.value)[0]
+    source.data = {
+        "x": [level.xs[i] for i in visible],
+        "y": [level.ys[i] for i in visible],
+        "country": [data.countries[i] for i in patch_country],
+        "Death_Rate_per_100k": rates[patch_country],
+    }
+
+# Initial data for the whole world
+set_view(-180, 180, -90, 90)
+
+# Color mapper (countries without data are drawn grey), ranges are precomputed per (cause, year)
+initial_low, initial_high = data.color_range("Tuberculosis", 2019, robust=ROBUST_COLORS)
 color_mapper = LinearColorMapper(palette=OrRd9[::-1],
-                                 low=merged["Death_Rate_per_100k"].min(),
-                                 high=merged["Death_Rate_per_100k"].max())
+                                 low=initial_low,
+                                 high=initial_high,
+                                 nan_color="lightgrey")
 
 # Plot
-p = figure(height=600, width=1200, toolbar_location="left", tools="pan,wheel_zoom,reset", title="Death Rate per 100k")
+p = figure(height=600, width=PLOT_WIDTH, toolbar_location="left", tools="pan,wheel_zoom,reset", title="Death Rate per 100k")
 p.xgrid.grid_line_color = None
 p.ygrid.grid_line_color = None
 patches = p.patches("x", "y", source=source,
@@ -113,27 +90,45 @@ p.add_layout(color_bar, "right")
 def update_data(attr, old, new):
     cause = cause_select.value
     year = year_slider.value
-    df = merged[(merged["Cause"] == cause) & (merged["Year"] == year)]
+    rates, low, high = frames.get(cause, year)
 
-    geo_df = world.merge(df, on="country", how="left").dropna(subset=["Death_Rate_per_100k", "geometry"])
-    
-    # Update data
-    source.data = dict(geo_to_coords(geo_df).data)
+    # Update only the rate column, the browser keeps the patch geometry
+    source.data["Death_Rate_per_100k"] = rates[view["patch_country"]]
     p.title.text = f"{cause} Death Rate per 100k in {year}"
 
-    # Dynamically update color mapper range
-    if not geo_df.empty:
-        vmin = geo_df["Death_Rate_per_100k"].min()
-        vmax = geo_df["Death_Rate_per_100k"].max()
-        color_mapper.low = vmin
-        color_mapper.high = vmax
+    # Precomputed color range for this frame
+    color_mapper.low = low
+    color_mapper.high = high
+
+# Play animation over the years
+play_button = Button(label="► Play", width=90)
+play_callback = None
+
+def animate_step():
+    year = year_slider.value + 1
+    if year > year_slider.end:
+        year = year_slider.start
+    year_slider.value = year
+
+def toggle_play():
+    global play_callback
+    if play_callback is None:
+        play_callback = curdoc().add_periodic_callback(animate_step, 300)
+        play_button.label = "❚❚ Pause"
+    else:
+        curdoc().remove_periodic_callback(play_callback)
+        play_callback = None
+        play_button.label = "► Play"
+
+play_button.on_click(toggle_play)
 
 # Callbacks
+p.on_event(RangesUpdate, lambda event: set_view(event.x0, event.x1, event.y0, event.y1))
 cause_select.on_change("value", update_data)
 year_slider.on_change("value", update_data)
 
 # Layout
-layout = column(cause_select, p, year_slider)
+layout = column(cause_select, p, row(year_slider, play_button))
 curdoc().add_root(layout)
 curdoc().title = "Interactive Global Mortality Map"
 
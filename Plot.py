@@ -4,11 +4,11 @@ Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
 """
 from preprocess import DataPreparation
 from EDA import run_initial_eda
-from Visualizations import plot_global_deathrate_trend, plot_top_and_bottom_causes, plot_population_age_violin, plot_top_causes_by_continent, plot_alcohol_vs_deathrate, plot_joint_kde, plot_rising_falling_causes, plot_top_cause_rank_shift
+from Visualizations import plot_global_deathrate_trend, plot_top_and_bottom_causes, plot_population_age_violin, plot_top_causes_by_continent, plot_alcohol_vs_deathrate, plot_alcohol_correlation_matrix, plot_joint_kde, plot_rising_falling_causes, plot_top_cause_rank_shift
 
 
-# Initialize preprocessing class
-prep = DataPreparation("data/cause_of_deaths.csv", "data/WPP2024_Population1JanuaryByAge5GroupSex_Medium.csv", "data/total-alcohol-consumption-per-capita-litres-of-pure-alcohol.csv")
+# Initialize preprocessing class (prepared tables are cached under data/cache, pass force_rebuild=True to redo them)
+prep = DataPreparation("data/cause_of_deaths.csv", "data/WPP2024_Population1JanuaryByAge5GroupSex_Medium.csv", "data/total-alcohol-consumption-per-capita-litres-of-pure-alcohol.csv", cache_dir="data/cache", verbose=True)
 
 #run_initial_eda(prep)
 
@@ -22,6 +22,8 @@ prep = DataPreparation("data/cause_of_deaths.csv", "data/WPP2024_Population1Janu
 
 #plot_alcohol_vs_deathrate(prep, "Cirrhosis and Other Chronic Liver Diseases", continent="Europe")
 #plot_alcohol_vs_deathrate(prep, "Drug Use Disorders") 
+#plot_alcohol_vs_deathrate(prep, "Drug Use Disorders", continent="Europe", summary=True)
+#plot_alcohol_correlation_matrix(prep)
 
 plot_joint_kde(prep,"Diarrheal Diseases", "Digestive Diseases",continent="Africa", year=1995)
 
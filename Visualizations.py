@@ -2,28 +2,67 @@
 Copyright C Philipp Mc Guire, 2025
 Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html 
 """
+import warnings
+
 import seaborn as sns
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from scipy.signal import fftconvolve
 from scipy.stats import pearsonr
 from matplotlib.patches import Patch
 
-def plot_global_deathrate_trend(prep):
-    # Access data
-    df = prep.death_df.pivot_table(index="Year", columns="Cause", values="Deaths", aggfunc="sum")
-    df["Total Deaths"] = df.sum(axis=1)
+from aggregates import CRUDE_RATE
+from ranks import region_name
+from trends import ALL_CAUSES, WORLD
+
+
+def save_figure(plot_func, prep, path, dpi=100, **kwargs):
+    """
+    Run plot_func(prep, **kwargs) and write the figure it draws to path.
+
+    Meant for a non-interactive backend such as Agg, where plt.show() does
+    nothing. Every call starts from the matplotlib defaults and restores the
+    previous rcParams afterwards, so styles set by one plot (sns.set) do not
+    leak into the next. Returns path, or None when the function drew no
+    figure (for example "Not enough data to plot.").
+    """
+    before = set(plt.get_fignums())
+    with plt.rc_context(), warnings.catch_warnings():
+        matplotlib.rcdefaults()
+        warnings.filterwarnings("ignore", message=".*non-interactive.*")
+        plot_func(prep, **kwargs)
+        new = [n for n in plt.get_fignums() if n not in before]
+        if not new:
+            return None
+
+        fig = plt.figure(new[-1])
+        fig.savefig(path, dpi=dpi, bbox_inches="tight")
+        for n in new:
+            plt.close(n)
+    return path
 
-    pop_total = prep.pop_df.groupby("Year")["Population_Total"].sum().reset_index()
-    global_summary = df.merge(pop_total, on="Year")
-    global_summary["Death_Rate_per_100k"] = (global_summary["Total Deaths"] / global_summary["Population_Total"]) * 1e5
+def plot_global_deathrate_trend(prep):
+    # Worldwide all-cause rate and its fit, one view of the shared trend table
+    years, rates = prep.aggregates.series(WORLD, ALL_CAUSES)
+    trends = prep.aggregates.trends
+    fit = trends[(trends["Region"] == WORLD) & (trends["Cause"] == ALL_CAUSES)].iloc[0]
+
+    # The total is missing where a cause has no rate, rather than a sum of the remaining causes
+    keep = ~np.isnan(rates)
+    if not keep.any():
+        missing = prep.aggregates.causes_without_rates()
+        print(f"No all-cause total for {prep.aggregates.rate_column}: "
+              f"{len(missing)} causes have no rates ({', '.join(missing[:5])}{', ...' if len(missing) > 5 else ''}).")
+        return
 
     # Regression
-    x = global_summary["Year"]
-    y = global_summary["Death_Rate_per_100k"]
-    slope, intercept = np.polyfit(x, y, 1)
-    reg_line = slope * x + intercept
-    percent_label = f"{abs((slope / y.iloc[0]) * 100):.1f}% decrease per year"
+    x = pd.Series(years[keep])
+    y = pd.Series(rates[keep])
+    reg_line = fit["Slope"] * x + fit["Intercept"]
+    direction = "decrease" if fit["Slope"] < 0 else "increase"
+    percent_label = f"{abs(fit['Pct_per_Year']):.1f}% {direction} per year"
 
     # Plot
     plt.figure(figsize=(12, 7))
@@ -35,7 +74,7 @@ def plot_global_deathrate_trend(prep):
     plt.text(x.iloc[-1], y.iloc[-1] + 5, f"{y.iloc[-1]:.1f}", color="green", weight="bold", ha="center")
     mid_x = x.iloc[len(x)//2]
     mid_y = reg_line.iloc[len(x)//2]
-    plt.text(mid_x + 2, mid_y + 10, f"▼ {percent_label}", color="forestgreen", fontsize=14, weight="bold")
+    plt.text(mid_x + 2, mid_y + 10, f"{'▼' if fit['Slope'] < 0 else '▲'} {percent_label}", color="forestgreen", fontsize=14, weight="bold")
 
     plt.title("Global Death Rate per 100,000 (1990–2019)", fontsize=18, weight="bold")
     plt.suptitle("Visualizing the Long-Term Trend in Mortality", fontsize=14, style="italic")
@@ -47,18 +86,24 @@ def plot_global_deathrate_trend(prep):
 
 def plot_top_and_bottom_causes(prep):
     df = prep.death_df.copy()
-    total_deaths = df.groupby("Cause")["Deaths"].sum().sort_values(ascending=False)
+    total_deaths = df.groupby("Cause", observed=True)["Deaths"].sum().sort_values(ascending=False)
 
     top5 = total_deaths.head(5).index.tolist()
     bottom5 = total_deaths.tail(5).index.tolist()
 
-    df = df[df["Cause"].isin(top5 + bottom5)]
-    pop_total = prep.pop_df.groupby(["country", "Year"])["Population_Total"].sum().reset_index()
-    merged = df.merge(pop_total, on=["country", "Year"], how="left")
-    merged = merged[merged["Population_Total"].notna()]
-    merged["Death_Rate_per_100k"] = (merged["Deaths"] / merged["Population_Total"]) * 1e5
+    if prep.aggregates.rate_column == CRUDE_RATE:
+        df = df[df["Cause"].isin(top5 + bottom5)]
+        pop_total = prep.aggregates.pop_totals
+        merged = df.merge(pop_total, on=["country", "Year"], how="left")
+        merged = merged[merged["Population_Total"].notna()]
+        merged["Death_Rate_per_100k"] = (merged["Deaths"] / merged["Population_Total"]) * 1e5
+    else:
+        # Another rate of merged_df, e.g. the model-adjusted one, under the same column name
+        merged = prep.merged_df[prep.merged_df["Cause"].isin(top5 + bottom5)]
+        merged = merged[["Year", "Cause"]].assign(Death_Rate_per_100k=merged[prep.aggregates.rate_column])
 
-    agg = merged.groupby(["Year", "Cause"])["Death_Rate_per_100k"].sum().reset_index()
+    agg = merged.groupby(["Year", "Cause"], observed=True)["Death_Rate_per_100k"].sum().reset_index()
+    agg["Cause"] = agg["Cause"].astype(str)
 
     fig, axs = plt.subplots(2, 1, figsize=(15, 10), sharex=True)
 
@@ -82,14 +127,42 @@ def plot_top_and_bottom_causes(prep):
     plt.show()
 
 
+def _weighted_kde(positions, counts, gridsize=100, cut=2):
+    """
+    Gaussian KDE of integer-weighted points, equal to seaborn's KDE of the
+    sample in which every position is repeated counts times (Scott's rule).
+    """
+    n = counts.sum()
+    w = counts / n
+    mean = (w * positions).sum()
+    var = (w * (positions - mean) ** 2).sum() * n / max(n - 1, 1)
+    bw = np.sqrt(var) * n ** (-1 / 5)
+
+    grid = np.linspace(positions.min() - cut * bw, positions.max() + cut * bw, gridsize)
+    z = (grid[:, None] - positions[None, :]) / bw
+    density = (np.exp(-0.5 * z ** 2) * w).sum(axis=1) / (bw * np.sqrt(2 * np.pi))
+    return grid, density
+
+
+def _weighted_quantiles(positions, counts, q):
+    # np.percentile (linear) of the repeated sample without building it
+    order = np.argsort(positions)
+    positions, counts = positions[order], counts[order]
+    ends = np.cumsum(counts)
+    h = (ends[-1] - 1) * np.asarray(q)
+    lo = positions[np.searchsorted(ends, np.floor(h), side="right")]
+    hi = positions[np.searchsorted(ends, np.ceil(h), side="right")]
+    return lo + (hi - lo) * (h - np.floor(h))
+
+
 def plot_population_age_violin(prep):
-    pop_df = prep.pop_df.copy()
+    pop_df = prep.pop_df
 
     # Filter to 1990 and 2019
     pop_compare = pop_df[pop_df["Year"].isin([1990, 2019])].copy()
 
     # Compute total population per country-year
-    total_pop = pop_compare.groupby(["country", "Year"])["Population_Total"].sum().reset_index()
+    total_pop = pop_compare.groupby(["country", "Year"], observed=True)["Population_Total"].sum().reset_index()
     total_pop.rename(columns={"Population_Total": "Country_Pop"}, inplace=True)
 
     # Merge and compute age share
@@ -98,68 +171,83 @@ def plot_population_age_violin(prep):
 
     # Filter to major continents
     major_continents = ["Africa", "Asia", "Europe", "North America", "South America", "Oceania"]
-    pop_compare = pop_compare[pop_compare["Continent"].isin(major_continents)]
-
-    # Create Continent-Year label
-    pop_compare["Continent_Year"] = pop_compare["Continent"] + " (" + pop_compare["Year"].astype(str) + ")"
-
-    # Expand rows to simulate age distribution
-    expanded_rows = []
-    for _, row in pop_compare.iterrows():
-        n = int(row["Age_Share"] * 500)  # Scale to 500 samples per continent-year
-        expanded_rows.extend([{
-            "Continent_Year": row["Continent_Year"],
-            "Age_Group": row["Age_Group"],
-            "Year": row["Year"],
-            "Continent": row["Continent"]
-        }] * n)
+    pop_compare = pop_compare[pop_compare["Continent"].isin(major_continents)].copy()
+    pop_compare["Continent"] = pop_compare["Continent"].astype(str)
+
+    # Age groups in their natural order as positions on the y axis
+    age_groups = [str(a) for a in pd.unique(pop_df["Age_Group"])]
+    pop_compare["Age_Pos"] = pd.Categorical(pop_compare["Age_Group"].astype(str), categories=age_groups).codes
+
+    # Weights: 500 samples per country-year spread over its age groups, summed per continent-year
+    pop_compare["Samples"] = (pop_compare["Age_Share"] * 500).astype(int)
+    weights = pop_compare.groupby(["Continent", "Year", "Age_Pos"])["Samples"].sum()
+    weights = weights[weights > 0]
+
+    # Weighted density and quartiles per continent-year
+    curves = {}
+    for (continent, year), counts in weights.groupby(level=[0, 1]):
+        positions = counts.index.get_level_values("Age_Pos").to_numpy(dtype=float)
+        counts = counts.to_numpy(dtype=float)
+        if counts.sum() < 2:
+            continue
+        grid, density = _weighted_kde(positions, counts)
+        curves[(continent, year)] = (grid, density, _weighted_quantiles(positions, counts, [0.25, 0.5, 0.75]))
+
+    if not curves:
+        print("Not enough data to plot.")
+        return
 
-    expanded_df = pd.DataFrame(expanded_rows)
+    # Violin plot: 1990 on the left half, 2019 on the right, same area for every half
+    continents = [c for c in major_continents if any(key[0] == c for key in curves)]
+    colors = sns.color_palette("Set2", 2)
+    peak = max(density.max() for _, density, _ in curves.values())
 
-    # Violin plot
     plt.figure(figsize=(16, 10))
-    sns.violinplot(data=expanded_df,x="Continent", y="Age_Group", hue="Year", split=True, palette="Set2", inner="quartile")
+    ax = plt.gca()
+    for i, continent in enumerate(continents):
+        for side, year, color in zip((-1, 1), (1990, 2019), colors):
+            if (continent, year) not in curves:
+                continue
+            grid, density, quartiles = curves[(continent, year)]
+            half = density / peak * 0.4
+            ax.fill_betweenx(grid, i, i + side * half, facecolor=color, edgecolor="0.3", linewidth=1.2)
+            for value, style in zip(quartiles, (":", "--", ":")):
+                width = np.interp(value, grid, half)
+                ax.plot([i, i + side * width], [value, value], linestyle=style, color="0.3", linewidth=1.2)
+
+    ax.set_xticks(range(len(continents)))
+    ax.set_xticklabels(continents)
+    ax.set_yticks(range(len(age_groups)))
+    ax.set_yticklabels(age_groups)
+    ax.invert_yaxis()
+
     plt.title("Age Distribution by Continent: 1990 vs. 2019", fontsize=18, weight="bold")
     plt.xlabel("Continent", fontsize=14)
     plt.ylabel("Age Group", fontsize=14)
     plt.xticks(rotation=45)
     plt.grid(True, linestyle="--", alpha=0.4)
-    plt.legend(title="Year", loc="upper right")
+    plt.legend(handles=[Patch(facecolor=c, edgecolor="0.3", label=str(y)) for y, c in zip((1990, 2019), colors)],
+               title="Year", loc="upper right")
     plt.tight_layout()
     plt.show()
 
 
 def plot_top_causes_by_continent(prep, continent):
 
-    # Extract and filter data
-    death_df = prep.death_df.copy()
-    pop_df = prep.pop_df.copy()
-    death_subset = death_df[death_df["Year"].isin([1990, 2019])].copy()
-    pop_subset = pop_df[pop_df["Year"].isin([1990, 2019])].copy()
-    
-    death_subset = death_subset.pivot_table(index=["country", "Year"], columns="Cause", values="Deaths").reset_index()
-    death_subset = death_subset.merge(pop_df[["country", "Continent"]].drop_duplicates(), on="country")
-    
-    death_data = death_subset[death_subset["Continent"] == continent]
-    pop_data = pop_subset[pop_subset["Continent"] == continent]
-
-    pop_totals = pop_data.groupby(["country", "Year"])["Population_Total"].sum().reset_index()
-    death_data = death_data.merge(pop_totals, on=["country", "Year"])
-
-    # Calculate death rates
-    cause_cols = death_data.columns.difference(["country", "Year", "Continent", "Population_Total"])
-    for cause in cause_cols:
-        death_data[cause + "_rate"] = (death_data[cause] / death_data["Population_Total"]) * 100000
-
-    rate_cols = [c for c in death_data.columns if c.endswith("_rate")]
-    by_year = death_data.groupby("Year")[rate_cols].sum().reset_index()
-    df_melted = by_year.melt(id_vars="Year", var_name="Cause", value_name="Death Rate per 100k")
-    df_melted["Cause"] = df_melted["Cause"].str.replace("_rate", "", regex=False)
+    # Death rates summed over the continent's countries and their ranks (shared rank table)
+    ranks = prep.aggregates.ranks
+    if not ranks.has(continent, 1990, 2019):
+        print(f"No data for {continent}.")
+        return
+    df_melted = pd.concat([
+        ranks.rates(continent, year).rename("Death Rate per 100k").rename_axis("Cause").reset_index().assign(Year=year)
+        for year in (1990, 2019)
+    ], ignore_index=True)
 
     # Top 5 causes
-    top5_1990 = df_melted[df_melted["Year"] == 1990].nlargest(5, "Death Rate per 100k")["Cause"].tolist()
-    top5_2019 = df_melted[df_melted["Year"] == 2019].nlargest(5, "Death Rate per 100k")["Cause"].tolist()
-    new_causes = [cause for cause in top5_2019 if cause not in top5_1990]
+    top5_1990 = ranks.top(continent, 1990, 5)
+    top5_2019 = ranks.top(continent, 2019, 5)
+    new_causes = ranks.new_entrants(continent, 1990, 2019, 5)
 
     # Prepare plotting data
     df_1990 = df_melted[df_melted["Cause"].isin(top5_1990)].copy()
@@ -167,8 +255,7 @@ def plot_top_causes_by_continent(prep, continent):
     df_1990 = df_1990.sort_values(["Cause", "Year"])
 
     df_2019 = df_melted[df_melted["Cause"].isin(top5_2019)].copy()
-    order_2019 = df_2019[df_2019["Year"] == 2019].sort_values("Death Rate per 100k", ascending=False)["Cause"].tolist()
-    df_2019["Cause"] = pd.Categorical(df_2019["Cause"], categories=order_2019, ordered=True)
+    df_2019["Cause"] = pd.Categorical(df_2019["Cause"], categories=top5_2019, ordered=True)
     df_2019 = df_2019.sort_values(["Cause", "Year"])
 
     # Plotting
@@ -201,21 +288,14 @@ def plot_top_causes_by_continent(prep, continent):
     plt.show()
 
 
-def plot_alcohol_vs_deathrate(prep, cause, continent=None, country=None):
-
-    death_df = prep.death_df.pivot_table(index=["country", "Year"], columns="Cause", values="Deaths").reset_index()
-    pop_df = prep.pop_df.copy()
-    alcohol_df = prep.alcohol_df.copy()
-
-    cause_cols = death_df.columns.difference(["country", "Year"])
-    death_long = death_df.melt(id_vars=["country", "Year"], value_vars=cause_cols, var_name="Cause", value_name="Deaths")
-
-    merged = death_long.merge(alcohol_df, on=["country", "Year"], how="left")
+def plot_alcohol_vs_deathrate(prep, cause, continent=None, country=None, summary=False):
 
-    merged = merged.merge(pop_df[["country", "Continent"]].drop_duplicates(), on="country", how="left")
+    # Region plots can be drawn from the precomputed histograms of every cause and region
+    if summary and not country:
+        return _plot_alcohol_summary(prep, cause, continent)
 
-    pop_total = pop_df.groupby(["country", "Year"])["Population_Total"].sum().reset_index()
-    merged = merged.merge(pop_total, on=["country", "Year"], how="left")
+    # merged_df already carries alcohol, continent, population and rate per country-year-cause
+    merged = prep.merged_df
 
     # Filter by cause and location
     merged = merged[merged["Cause"] == cause]
@@ -225,16 +305,16 @@ def plot_alcohol_vs_deathrate(prep, cause, continent=None, country=None):
         merged = merged[merged["country"] == country]
 
     merged = merged[(merged["Population_Total"] > 0)& merged["Deaths"].notna()& merged["Alcohol_Consumption_Liters"].notna()].copy()
-    merged["Death_Rate_per_100k"] = (merged["Deaths"] / merged["Population_Total"]) * 1e5
 
     if merged.empty or len(merged) < 5:
         print("Not enough data to plot.")
         return
 
-    corr = merged[["Alcohol_Consumption_Liters", "Death_Rate_per_100k"]].corr().iloc[0, 1]
+    rate_col = prep.aggregates.rate_column
+    corr = merged[["Alcohol_Consumption_Liters", rate_col]].corr().iloc[0, 1]
 
     sns.set(style="whitegrid", context="talk")
-    g = sns.jointplot(data=merged, x="Alcohol_Consumption_Liters", y="Death_Rate_per_100k", kind="hex", cmap="mako_r", height=10, marginal_kws=dict(bins=30, fill=True))
+    g = sns.jointplot(data=merged, x="Alcohol_Consumption_Liters", y=rate_col, kind="hex", cmap="mako_r", height=10, marginal_kws=dict(bins=30, fill=True))
     g.fig.set_figwidth(15)
     g.fig.set_figheight(10)
     g.ax_joint.set_xlabel("Alcohol Consumption (liters per capita)")
@@ -256,15 +336,125 @@ def plot_alcohol_vs_deathrate(prep, cause, continent=None, country=None):
     plt.show()
 
 
-def plot_joint_kde(prep, cause_x, cause_y, continent=None, year=None):
+def _plot_alcohol_summary(prep, cause, continent=None):
+    summary = prep.aggregates.alcohol_summary
+    region = continent or WORLD
+    hist = summary.histogram(cause, region)
+    if hist is None or hist[0].sum() < 5:
+        print("Not enough data to plot.")
+        return
+    counts, x_edges, y_edges = hist
+    corr = summary.correlation(cause, region)
+
+    sns.set(style="whitegrid", context="talk")
+    g = sns.JointGrid(height=10)
+    g.fig.set_figwidth(15)
+    g.fig.set_figheight(10)
+    g.ax_joint.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), cmap="mako_r")
+    color = sns.color_palette("mako_r", 10)[-3]
+    g.ax_marg_x.bar(x_edges[:-1], counts.sum(axis=1), width=np.diff(x_edges), align="edge", color=color, alpha=0.6)
+    g.ax_marg_y.barh(y_edges[:-1], counts.sum(axis=0), height=np.diff(y_edges), align="edge", color=color, alpha=0.6)
+    g.ax_joint.set_xlabel("Alcohol Consumption (liters per capita)")
+    g.ax_joint.set_ylabel(f"{cause} Death Rate (per 100k)")
 
-    death_df = prep.death_df.pivot_table(index=["country", "Year"], columns="Cause", values="Deaths").reset_index()
-    pop_df = prep.pop_df.copy()
+    title = f"Alcohol vs. {cause} Death Rate (2000–2019) — {region}"
+    g.fig.subplots_adjust(top=0.9)
+    g.fig.suptitle(title, fontsize=18, fontweight="bold")
+    g.fig.text(0.5, 0.87, f"Pearson Corr: {corr:.2f}", ha="center", fontsize=13, style="italic")
+    plt.show()
 
-    df = death_df.merge(pop_df[["country", "Continent"]].drop_duplicates(), on="country", how="left")
 
-    pop_total = pop_df.groupby(["country", "Year"])["Population_Total"].sum().reset_index()
-    df = df.merge(pop_total, on=["country", "Year"], how="left")
+def plot_alcohol_correlation_matrix(prep, min_count=5):
+
+    # Causes ranked by their worldwide correlation with alcohol consumption, per continent alongside
+    matrix = prep.aggregates.alcohol_summary.correlation_matrix(min_count)
+    if matrix.empty:
+        print("Not enough data to plot.")
+        return
+
+    plt.figure(figsize=(14, max(6, 0.4 * len(matrix))))
+    sns.heatmap(matrix, annot=True, fmt=".2f", cmap="RdBu_r", vmin=-1, vmax=1, center=0,
+                linewidths=0.5, cbar_kws={"label": "Pearson Correlation"})
+    plt.title("Correlation of Alcohol Consumption with Death Rates (2000–2019)", fontsize=16, weight="bold")
+    plt.xlabel("Region", fontsize=13)
+    plt.ylabel("Cause of Death", fontsize=13)
+    plt.tight_layout()
+    plt.show()
+
+
+def _binned_kde_1d(values, gridsize=200, cut=3):
+    """Gaussian KDE (Scott's rule) of values, binned onto a grid and convolved by FFT."""
+    n = len(values)
+    bw = values.std(ddof=1) * n ** (-1 / 5)
+    edges = np.linspace(values.min() - cut * bw, values.max() + cut * bw, gridsize + 1)
+    counts, _ = np.histogram(values, bins=edges)
+    step = edges[1] - edges[0]
+    m = int(np.ceil(4 * bw / step))
+    offsets = np.arange(-m, m + 1) * step
+    kernel = np.exp(-0.5 * (offsets / bw) ** 2)
+    density = fftconvolve(counts, kernel, mode="same") / (n * bw * np.sqrt(2 * np.pi))
+    return (edges[:-1] + edges[1:]) / 2, np.clip(density, 0, None)
+
+
+def _binned_kde_2d(x, y, gridsize=200, cut=3):
+    """
+    Gaussian KDE of the points (x, y) with Scott's full covariance bandwidth,
+    as in scipy's gaussian_kde, computed by binning onto a gridsize x gridsize
+    grid and convolving the counts with the kernel by FFT.
+
+    Returns:
+    --------
+    (xx, yy, density) with density[i, j] at (xx[j], yy[i])
+    """
+    n = len(x)
+    cov = np.cov(x, y) * n ** (-1 / 3)
+    sx, sy = np.sqrt(np.diag(cov))
+    x_edges = np.linspace(x.min() - cut * sx, x.max() + cut * sx, gridsize + 1)
+    y_edges = np.linspace(y.min() - cut * sy, y.max() + cut * sy, gridsize + 1)
+    counts, _, _ = np.histogram2d(y, x, bins=[y_edges, x_edges])
+
+    # Kernel on the grid offsets, wide enough for 4 standard deviations
+    dx, dy = x_edges[1] - x_edges[0], y_edges[1] - y_edges[0]
+    mx, my = int(np.ceil(4 * sx / dx)), int(np.ceil(4 * sy / dy))
+    ox, oy = np.meshgrid(np.arange(-mx, mx + 1) * dx, np.arange(-my, my + 1) * dy)
+    inv = np.linalg.inv(cov)
+    kernel = np.exp(-0.5 * (inv[0, 0] * ox ** 2 + 2 * inv[0, 1] * ox * oy + inv[1, 1] * oy ** 2))
+
+    density = fftconvolve(counts, kernel, mode="same") / (n * 2 * np.pi * np.sqrt(np.linalg.det(cov)))
+    xx = (x_edges[:-1] + x_edges[1:]) / 2
+    yy = (y_edges[:-1] + y_edges[1:]) / 2
+    return xx, yy, np.clip(density, 0, None)
+
+
+def _quantile_to_level(density, quantile):
+    # Density values enclosing the given probability mass, as in seaborn
+    values = np.sort(density.ravel())[::-1]
+    normalized = np.cumsum(values) / values.sum()
+    idx = np.searchsorted(normalized, 1 - np.asarray(quantile))
+    return np.take(values, idx, mode="clip")
+
+
+def _fill_levels(density, thresh=0.05, n_levels=10):
+    # Strictly increasing contourf levels from the thresh mass level up to the density peak
+    levels = np.unique(_quantile_to_level(density, np.linspace(thresh, 1, n_levels)[:-1]))
+    levels = levels[levels > 0]
+    peak = density.max()
+    if not levels.size or levels[-1] < peak:
+        levels = np.append(levels, peak)
+    return levels
+
+
+def plot_joint_kde(prep, cause_x, cause_y, continent=None, year=None, fast_threshold=2000):
+    """
+    Joint density of two causes' death rates across country-years.
+
+    Above fast_threshold points the density is binned and computed by FFT
+    convolution instead of seaborn's exact KDE, which is linear in the
+    number of points per grid cell.
+    """
+
+    # Per-cause death rates per country-year (shared aggregate)
+    df = prep.aggregates.rate_wide
 
     # Filter
     if continent:
@@ -272,9 +462,7 @@ def plot_joint_kde(prep, cause_x, cause_y, continent=None, year=None):
     if year:
         df = df[df["Year"] == year]
 
-    # Compute death rates
-    df["x_rate"] = (df[cause_x] / df["Population_Total"]) * 100000
-    df["y_rate"] = (df[cause_y] / df["Population_Total"]) * 100000
+    df = df.assign(x_rate=df[cause_x + "_rate"], y_rate=df[cause_y + "_rate"])
     df = df[(df["x_rate"].notna()) & (df["y_rate"].notna())]
 
     if df.empty or len(df) < 5:
@@ -283,7 +471,24 @@ def plot_joint_kde(prep, cause_x, cause_y, continent=None, year=None):
 
     # Plot KDE
     sns.set(style="white", font_scale=1.2)
-    g = sns.jointplot(data=df, x="x_rate", y="y_rate", kind="kde", fill=True, thresh=0.05, cmap="mako_r", height=8)
+    if len(df) <= fast_threshold:
+        g = sns.jointplot(data=df, x="x_rate", y="y_rate", kind="kde", fill=True, thresh=0.05, cmap="mako_r", height=8)
+    else:
+        x = df["x_rate"].to_numpy(dtype=float)
+        y = df["y_rate"].to_numpy(dtype=float)
+        g = sns.JointGrid(data=df, x="x_rate", y="y_rate", height=8)
+
+        xx, yy, density = _binned_kde_2d(x, y)
+        g.ax_joint.contourf(xx, yy, density, levels=_fill_levels(density), cmap="mako_r")
+
+        # Marginal densities
+        color = sns.color_palette("mako_r", 10)[-3]
+        grid, marginal = _binned_kde_1d(x)
+        g.ax_marg_x.fill_between(grid, marginal, color=color, alpha=0.25)
+        g.ax_marg_x.plot(grid, marginal, color=color)
+        grid, marginal = _binned_kde_1d(y)
+        g.ax_marg_y.fill_betweenx(grid, marginal, color=color, alpha=0.25)
+        g.ax_marg_y.plot(marginal, grid, color=color)
     g.set_axis_labels( f"{cause_x} Death Rate (per 100k)", f"{cause_y} Death Rate (per 100k)", fontsize=12)
     g.fig.set_figwidth(15)
     g.fig.set_figheight(10)
@@ -307,23 +512,20 @@ def plot_joint_kde(prep, cause_x, cause_y, continent=None, year=None):
 
     plt.show()
 
-def plot_rising_falling_causes(prep, continent=None):
-
-    df = prep.merged_df.copy()
-
-    if continent:
-        df = df[df["Continent"] == continent]
-
-    agg = df.groupby(["Year", "Cause"])["Death_Rate_per_100k"].sum().reset_index()
-    pivot = agg.pivot(index="Cause", columns="Year", values="Death_Rate_per_100k")
+def plot_rising_falling_causes(prep, continent=None, country=None, base_year=1990, target_year=2019):
 
-    if 1990 not in pivot.columns or 2019 not in pivot.columns:
-        print("1990 or 2019 missing from data.")
+    # Percent change per cause, looked up in the precomputed change table
+    changes = prep.aggregates.changes
+    region = region_name(continent, country)
+    if region not in changes.region_index:
+        print(f"No data for {region}.")
+        return
+    if not changes.has(region, base_year, target_year):
+        print(f"{base_year} or {target_year} missing from data.")
         return
 
-    pivot = pivot.dropna(subset=[1990, 2019])
-    pivot["% Change"] = ((pivot[2019] - pivot[1990]) / pivot[1990]) * 100
-    pivot = pivot.sort_values("% Change", ascending=False).reset_index()
+    pivot = changes.change(region, base_year, target_year).dropna().astype(float)
+    pivot = pivot.sort_values(ascending=False).reset_index()
 
     # Color logic
     def classify_color(change):
@@ -343,7 +545,7 @@ def plot_rising_falling_causes(prep, continent=None):
     bars = ax.barh(pivot["Cause"], pivot["% Change"], color=pivot["Color"])
 
     ax.axvline(0, color="black", linewidth=1)
-    ax.set_title(f"Change in Cause of Death Rates (1990–2019){' — ' + continent if continent else ' — World wide'}", fontsize=16, weight="bold")
+    ax.set_title(f"Change in Cause of Death Rates ({base_year}–{target_year}){' — ' + region if region != WORLD else ' — World wide'}", fontsize=16, weight="bold")
     ax.set_xlabel("Percent Change in Death Rate")
     ax.set_ylabel("Cause of Death")
     ax.grid(True, axis="x", linestyle="--", alpha=0.5)
@@ -361,52 +563,26 @@ def plot_rising_falling_causes(prep, continent=None):
 
     plt.show()
 
-def plot_top_cause_rank_shift(prep, continent=None, country=None, top_n=10):
-
-    df = prep.merged_df.copy()
+def plot_top_cause_rank_shift(prep, continent=None, country=None, top_n=10, global_ranks=False):
 
-    if continent:
-        df = df[df["Continent"] == continent]
-    if country:
-        df = df[df["country"] == country]
-
-    df = df[df["Year"].isin([1990, 2019])]
-
-    pivot_df = df.pivot_table(index=["country", "Year"], columns="Cause", values="Deaths").reset_index()
-    pivot_df = pivot_df.merge(df[["country", "Continent"]].drop_duplicates(), on="country")
-    if continent:
-        pivot_df = pivot_df[pivot_df["Continent"] == continent]
-
-    pop_df = prep.pop_df.copy()
-    pop_df = pop_df[pop_df["Year"].isin([1990, 2019])]
-    if continent:
-        pop_df = pop_df[pop_df["Continent"] == continent]
-
-    pop_totals = pop_df.groupby(["country", "Year"])["Population_Total"].sum().reset_index()
-    pivot_df = pivot_df.merge(pop_totals, on=["country", "Year"])
-
-    cause_cols = pivot_df.columns.difference(["country", "Year", "Continent", "Population_Total"])
-    for cause in cause_cols:
-        pivot_df[cause + "_rate"] = (pivot_df[cause] / pivot_df["Population_Total"]) * 100000
-
-    # Sum by Year for the continent
-    rate_cols = [c for c in pivot_df.columns if c.endswith("_rate")]
-    by_year = pivot_df.groupby("Year")[rate_cols].sum().reset_index()
-
-    df_melted = by_year.melt(id_vars="Year", var_name="Cause", value_name="Death Rate per 100k")
-    df_melted["Cause"] = df_melted["Cause"].str.replace("_rate", "", regex=False)
+    # Death rates and ranks of all causes in the region (shared rank table)
+    ranks = prep.aggregates.ranks
+    region = region_name(continent, country)
+    if not ranks.has(region, 1990, 2019):
+        print(f"No data for {region}.")
+        return
 
     # Top N causes per year
-    top_1990 = df_melted[df_melted["Year"] == 1990].nlargest(top_n, "Death Rate per 100k")["Cause"]
-    top_2019 = df_melted[df_melted["Year"] == 2019].nlargest(top_n, "Death Rate per 100k")["Cause"]
-    top_combined = pd.Series(top_1990.tolist() + top_2019.tolist()).unique()
-
-    # Filter and rank
-    df_melted = df_melted[df_melted["Cause"].isin(top_combined)]
-    df_melted["Rank"] = df_melted.groupby("Year")["Death Rate per 100k"].rank(ascending=False, method="min")
+    top_combined = pd.unique(pd.Series(ranks.top(region, 1990, top_n) + ranks.top(region, 2019, top_n)))
 
-    # Pivot to get ranks
-    pivot = df_melted.pivot(index="Cause", columns="Year", values="Rank").dropna()
+    if global_ranks:
+        # Rank among all causes
+        pivot = ranks.rank_frame(region, [1990, 2019]).loc[top_combined]
+        pivot = pivot[(pivot > 0).all(axis=1)]
+    else:
+        # Rank among the selected causes only
+        rates = pd.DataFrame({year: ranks.rates(region, year).loc[top_combined] for year in (1990, 2019)})
+        pivot = rates.rank(ascending=False, method="min").dropna()
     all_ranks = sorted(set(pivot[1990]).union(pivot[2019]))
     pivot = pivot.sort_values(1990)
 
@@ -0,0 +1,178 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+
+Model-adjusted death rates.
+
+The death data has no age breakdown, so the age-specific rates that a direct
+standardization needs are not observed, and the result is not an
+age-standardized rate. Instead, age-specific rates are modelled as
+
+    rate(country, year, cause, age) = level(country, year, cause) * relative_risk(profile(cause), age)
+
+Each cause has a coarse age profile: an assumed shape of its risk over the
+age groups, not an estimate. Examples are Gompertz for chronic diseases,
+under-5 only for neonatal disorders, and ages 15-49 for maternal disorders.
+The level follows from the observed deaths and the country's age structure.
+The adjusted rate is the rate the model gives for the standard population:
+
+    adjusted = crude_rate * sum(standard_share * rr) / sum(country_share * rr)
+
+The factor depends on country, year and profile. All causes are adjusted
+with one matrix product and a gather. Causes without a profile in
+CAUSE_PROFILES get NaN, since no age shape is assumed for them.
+"""
+import numpy as np
+import pandas as pd
+
+# WHO World Standard Population (2000-2025), per 100,000, by five-year age group
+WHO_STANDARD_POPULATION = {
+    "0-4": 8860, "5-9": 8690, "10-14": 8600, "15-19": 8470, "20-24": 8220,
+    "25-29": 7930, "30-34": 7610, "35-39": 7150, "40-44": 6590, "45-49": 6040,
+    "50-54": 5370, "55-59": 4550, "60-64": 3720, "65-69": 2960, "70-74": 2210,
+    "75-79": 1520, "80-84": 910, "85-89": 440, "90-94": 150, "95-99": 40, "100+": 5,
+}
+
+# Gompertz slope: all-cause mortality roughly doubles every eight years of age
+GOMPERTZ_SLOPE = 0.085
+
+MODEL_ADJUSTED_RATE = "Model_Adjusted_Death_Rate_per_100k"
+
+# Assumed age profile per cause; causes not listed are left unadjusted (NaN)
+CAUSE_PROFILES = {
+    "Alzheimer's Disease and Other Dementias": "gompertz",
+    "Parkinson's Disease": "gompertz",
+    "Cardiovascular Diseases": "gompertz",
+    "Neoplasms": "gompertz",
+    "Diabetes Mellitus": "gompertz",
+    "Chronic Kidney Disease": "gompertz",
+    "Chronic Respiratory Diseases": "gompertz",
+    "Digestive Diseases": "gompertz",
+    "Cirrhosis and Other Chronic Liver Diseases": "gompertz",
+    "Neonatal Disorders": "neonatal",
+    "Maternal Disorders": "maternal",
+    "Diarrheal Diseases": "child_and_old",
+    "Lower Respiratory Infections": "child_and_old",
+    "Meningitis": "child_and_old",
+    "Malaria": "child_and_old",
+    "Nutritional Deficiencies": "child_and_old",
+    "Protein-Energy Malnutrition": "child_and_old",
+    "HIV/AIDS": "adult",
+    "Tuberculosis": "adult",
+    "Drug Use Disorders": "adult",
+    "Alcohol Use Disorders": "adult",
+    "Self-harm": "adult",
+    "Interpersonal Violence": "adult",
+    "Road Injuries": "adult",
+}
+
+
+def age_midpoints(groups):
+    """Midpoint age of groups such as "0-4" or "100+"."""
+    mids = []
+    for group in groups:
+        group = str(group)
+        if group.endswith("+"):
+            mids.append(float(group[:-1]) + 2.5)
+        else:
+            low, high = group.split("-")
+            mids.append((float(low) + float(high) + 1) / 2)
+    return np.array(mids)
+
+
+def profile_relative_risks(groups, slope=GOMPERTZ_SLOPE):
+    """
+    Relative risk per age group (rows) for every profile (columns).
+
+    gompertz rises exponentially with age. neonatal is limited to ages
+    0-4 and maternal to ages 15-49. child_and_old combines a peak at ages
+    0-4 with a Gompertz rise in old age. adult is flat from age 15, at a
+    tenth of that level below.
+    """
+    mids = age_midpoints(groups)
+    gompertz = np.exp(slope * (mids - mids.min()))
+    profiles = {
+        "gompertz": gompertz,
+        "neonatal": (mids < 5).astype(np.float64),
+        "maternal": ((mids >= 15) & (mids < 50)).astype(np.float64),
+        "child_and_old": np.where(mids < 5, 1.0, np.where(mids < 15, 0.1, 0.0)) + np.exp(slope * (mids - 82.5)),
+        "adult": np.where(mids >= 15, 1.0, 0.1),
+    }
+    return pd.DataFrame(profiles, index=list(groups))
+
+
+def standard_weights(pop_df, standard="who"):
+    """
+    Age shares of the standard population, summing to 1.
+
+    standard is "who" for the WHO World Standard Population or a year for
+    the world population of that year in pop_df.
+    """
+    if standard == "who":
+        weights = pd.Series(WHO_STANDARD_POPULATION, dtype=np.float64)
+    else:
+        year = pop_df[pop_df["Year"] == int(standard)]
+        if year.empty:
+            raise ValueError(f"No population data for standard year {standard}")
+        weights = year.groupby(year["Age_Group"].astype(str))["Population_Total"].sum().astype(np.float64)
+    return weights / weights.sum()
+
+
+def adjustment_factors(pop_df, standard="who", relative_risks=None, weights=None):
+    """
+    Factor turning a crude rate into a model-adjusted one, per country-year and profile.
+
+    Parameters:
+    -----------
+    pop_df : pd.DataFrame
+        Age-resolved population with country_id, Year, Age_Group and Population_Total.
+    standard : "who" or int
+        Standard population, see standard_weights.
+    relative_risks : pd.DataFrame, optional
+        Relative risk per age group (rows) and profile (columns). Defaults to
+        profile_relative_risks.
+    weights : pd.Series, optional
+        Precomputed standard_weights, e.g. from the full table when pop_df is
+        only a subset of country-years.
+
+    Returns:
+    --------
+    pd.DataFrame indexed by (country_id, Year) with one column per profile
+    """
+    pop = pop_df[pop_df["country_id"] >= 0]
+    by_age = pop.pivot_table(index=["country_id", "Year"], columns=pop["Age_Group"].astype(str),
+                             values="Population_Total", aggfunc="sum", fill_value=0.0)
+
+    if weights is None:
+        weights = standard_weights(pop_df, standard)
+    groups = [g for g in weights.index if g in by_age.columns]
+    if relative_risks is None:
+        relative_risks = profile_relative_risks(groups)
+    rr = relative_risks.reindex(groups).to_numpy(dtype=np.float64)
+
+    # Age shares of every country-year, shape (country-years, age groups)
+    counts = by_age[groups].to_numpy(dtype=np.float64)
+    shares = counts / counts.sum(axis=1, keepdims=True)
+
+    w = weights.reindex(groups).to_numpy(dtype=np.float64)
+    w = w / w.sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        factors = (w @ rr)[None, :] / (shares @ rr)
+    index = pd.MultiIndex.from_arrays([by_age.index.get_level_values(0).astype(np.int64),
+                                       by_age.index.get_level_values(1).astype(np.int64)], names=["country_id", "Year"])
+    return pd.DataFrame(factors, index=index, columns=relative_risks.columns)
+
+
+def adjusted_rates(merged, factors, keys):
+    """
+    Model-adjusted rate of every row of merged, given the (country_id, Year)
+    keys of its rows and the factors of adjustment_factors.
+    """
+    rows = factors.index.get_indexer(keys)
+    profiles = merged["Cause"].astype(str).map(CAUSE_PROFILES)
+    cols = pd.Index(factors.columns).get_indexer(profiles.fillna(""))
+    table = np.vstack([factors.to_numpy(), np.full((1, factors.shape[1]), np.nan)])
+    table = np.hstack([table, np.full((table.shape[0], 1), np.nan)])
+    # Missing country-years and causes without a profile gather the NaN row/column
+    factor = table[rows, cols]
+    return merged["Death_Rate_per_100k"].to_numpy(dtype=np.float64) * factor
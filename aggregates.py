@@ -0,0 +1,133 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import os
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from alcohol_summary import AlcoholSummary
+from changes import ChangeTable
+from ranks import RankTable
+from rate_cube import RateCube
+from trends import region_series, trend_table
+
+CRUDE_RATE = "Death_Rate_per_100k"
+
+
+def _country_year_index(country, year):
+    return pd.MultiIndex.from_arrays([np.asarray(country).astype(str), np.asarray(year).astype(np.int64)])
+
+
+class AggregateStore:
+    """
+    Intermediates shared by the plotting functions in Visualizations.py.
+
+    Each aggregate is computed from the owning DataPreparation on first access
+    and memoized, so rendering many variants of a plot pays for it once.
+    """
+
+    def __init__(self, prep, rate_column=CRUDE_RATE):
+        self.prep = prep
+        self.rate_column = rate_column
+
+    @cached_property
+    def pop_totals(self):
+        # Population per country-year
+        return self.prep.pop_total_df[["country", "Year", "Population_Total"]]
+
+    @cached_property
+    def country_continent(self):
+        return self.prep.pop_total_df[["country", "Continent"]].drop_duplicates().reset_index(drop=True)
+
+    @cached_property
+    def death_wide(self):
+        # Deaths pivoted to one row per country-year and one column per cause
+        wide = self.prep.death_df.pivot_table(index=["country", "Year"], columns="Cause", values="Deaths", observed=True)
+        wide.columns = wide.columns.astype(str)
+        wide.columns.name = None
+        return wide.reset_index()
+
+    @cached_property
+    def causes(self):
+        return [c for c in self.death_wide.columns if c not in ("country", "Year")]
+
+    @cached_property
+    def rate_wide(self):
+        # death_wide joined to continent and population, plus a <cause>_rate column of rate_column per cause
+        df = self.death_wide.merge(self.country_continent, on="country")
+        df = df.merge(self.pop_totals, on=["country", "Year"])
+        if self.rate_column == CRUDE_RATE:
+            rates = df[self.causes].div(df["Population_Total"], axis=0) * 100000
+        else:
+            wide = self.prep.merged_df.pivot_table(index=["country", "Year"], columns="Cause",
+                                                   values=self.rate_column, observed=True)
+            wide.columns = wide.columns.astype(str)
+            wide.index = _country_year_index(wide.index.get_level_values(0), wide.index.get_level_values(1))
+            keys = _country_year_index(df["country"], df["Year"])
+            rates = wide.reindex(index=keys, columns=self.causes)
+            rates.index = df.index
+        rates.columns = [c + "_rate" for c in self.causes]
+        return pd.concat([df, rates], axis=1)
+
+    @cached_property
+    def rate_cube(self):
+        """
+        Dense (country, year, cause) cube of rate_column built from merged_df.
+
+        With a cache directory it is stored next to the cached tables and
+        reopened memory-mapped, so other processes share it without copying.
+        """
+        directory = None
+        if self.prep.cache_dir:
+            name = "cube" if self.rate_column == CRUDE_RATE else f"cube_{self.rate_column}"
+            directory = os.path.join(self.prep.cache_dir, self.prep.cache_key, name)
+            if RateCube.exists(directory):
+                return RateCube.load(directory)
+
+        cube = RateCube.from_frame(self.prep.merged_df, self.rate_column)
+        if directory and os.path.isdir(os.path.dirname(directory)):
+            cube.save(directory)
+            return RateCube.load(directory)
+        return cube
+
+    @cached_property
+    def ranks(self):
+        # Rank of every cause per year for every country, continent and the world
+        return RankTable.from_cube(self.rate_cube)
+
+    @cached_property
+    def changes(self):
+        # Percent change of every cause between every pair of years, per region
+        return ChangeTable.from_ranks(self.ranks)
+
+    @cached_property
+    def trend_series(self):
+        # (labels, values) of the rate series of every country, continent and the world per cause
+        return region_series(self.rate_cube)
+
+    @cached_property
+    def trends(self):
+        """Linear trend of every series in trend_series, one row per region and cause."""
+        labels, values = self.trend_series
+        return trend_table(labels, values, self.rate_cube.years)
+
+    def causes_without_rates(self):
+        """Causes of the rate cube without a single rate_column value."""
+        empty = np.isnan(self.rate_cube.rates).all(axis=(0, 1))
+        return [c for c, e in zip(self.rate_cube.causes, empty) if e]
+
+    def series(self, region, cause):
+        """Years and rate values of one series of trend_series, or None if it does not exist."""
+        labels, values = self.trend_series
+        rows = (labels["Region"] == region) & (labels["Cause"] == cause)
+        if not rows.any():
+            return None
+        return np.array(self.rate_cube.years), values[np.flatnonzero(rows)[0]]
+
+    @cached_property
+    def alcohol_summary(self):
+        # Alcohol vs. death rate histograms and correlations for every region and cause
+        return AlcoholSummary(self.prep.merged_df, value_col=self.rate_column)
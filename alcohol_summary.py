@@ -0,0 +1,107 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import numpy as np
+import pandas as pd
+
+from trends import WORLD
+
+
+class AlcoholSummary:
+    """
+    2D histograms and Pearson correlations of alcohol consumption against
+    death rate for every (region, cause), built in one pass over merged_df.
+
+    Regions are WORLD followed by the continents. counts has shape
+    (regions, causes, bins, bins) and is indexed [region, cause, x bin, y bin].
+    x_edges and y_edges have shape (regions, causes, bins + 1): every
+    (region, cause) is binned over the range of its own data, as a hexbin of
+    that region would be. table holds one row per (region, cause) with the
+    point count and the Pearson correlation.
+    """
+
+    def __init__(self, merged, bins=30, value_col="Death_Rate_per_100k"):
+        mask = (merged["Population_Total"] > 0) & merged[value_col].notna() & merged["Alcohol_Consumption_Liters"].notna()
+        df = merged.loc[mask]
+
+        cause_codes, causes = pd.factorize(df["Cause"], sort=True)
+        continent_codes, continents = pd.factorize(df["Continent"], sort=True)
+        self.causes = [str(c) for c in causes]
+        self.regions = [WORLD] + [str(c) for c in continents]
+        self.bins = bins
+
+        x = df["Alcohol_Consumption_Liters"].to_numpy(dtype=np.float64)
+        y = df[value_col].to_numpy(dtype=np.float64)
+        n_causes = len(self.causes)
+
+        # Every row counts towards the world and, if it has one, its continent
+        has_continent = continent_codes >= 0
+        region = np.concatenate([np.zeros(len(x), dtype=np.int64), continent_codes[has_continent] + 1])
+        rows = np.concatenate([np.arange(len(x)), np.flatnonzero(has_continent)])
+        group = region * n_causes + cause_codes[rows]
+        n_groups = len(self.regions) * n_causes
+        xr, yr = x[rows], y[rows]
+
+        # Bins over the range of every (region, cause)
+        x_low, x_span = self._ranges(xr, group, n_groups)
+        y_low, y_span = self._ranges(yr, group, n_groups)
+        steps = np.linspace(0, 1, bins + 1)[None, :]
+        shape = (len(self.regions), n_causes, bins + 1)
+        self.x_edges = (x_low[:, None] + x_span[:, None] * steps).reshape(shape)
+        self.y_edges = (y_low[:, None] + y_span[:, None] * steps).reshape(shape)
+
+        xi = np.clip(((xr - x_low[group]) / x_span[group] * bins).astype(np.int64), 0, bins - 1)
+        yi = np.clip(((yr - y_low[group]) / y_span[group] * bins).astype(np.int64), 0, bins - 1)
+        flat = (group * bins + xi) * bins + yi
+        self.counts = np.bincount(flat, minlength=n_groups * bins * bins).reshape(len(self.regions), n_causes, bins, bins)
+
+        # Pearson r from grouped sums
+        n = np.bincount(group, minlength=n_groups).astype(np.float64)
+        sx = np.bincount(group, xr, n_groups)
+        sy = np.bincount(group, yr, n_groups)
+        sxx = np.bincount(group, xr * xr, n_groups)
+        syy = np.bincount(group, yr * yr, n_groups)
+        sxy = np.bincount(group, xr * yr, n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+        r = np.where(n >= 2, np.clip(r, -1, 1), np.nan)
+
+        self.table = pd.DataFrame({
+            "Region": np.repeat(self.regions, n_causes),
+            "Cause": np.tile(self.causes, len(self.regions)),
+            "Count": n.astype(np.int64),
+            "Pearson": r,
+        })
+
+    @staticmethod
+    def _ranges(values, group, n_groups):
+        # Minimum and span of values per group, a span of 1 for empty or constant groups
+        low = np.full(n_groups, np.inf)
+        high = np.full(n_groups, -np.inf)
+        np.minimum.at(low, group, values)
+        np.maximum.at(high, group, values)
+        empty = ~np.isfinite(low)
+        low[empty] = 0.0
+        span = np.where(high > low, high - low, 1.0)
+        return low, span
+
+    def histogram(self, cause, region=WORLD):
+        """Return (counts, x_edges, y_edges) of one cause and region, or None if unknown."""
+        if cause not in self.causes or region not in self.regions:
+            return None
+        r, k = self.regions.index(region), self.causes.index(cause)
+        return self.counts[r, k], self.x_edges[r, k], self.y_edges[r, k]
+
+    def correlation(self, cause, region=WORLD):
+        row = self.table[(self.table["Region"] == region) & (self.table["Cause"] == cause)]
+        return row.iloc[0]["Pearson"] if len(row) else np.nan
+
+    def correlation_matrix(self, min_count=5):
+        """Causes x regions Pearson correlations, causes ranked by their worldwide correlation."""
+        table = self.table[self.table["Count"] >= min_count]
+        matrix = table.pivot(index="Cause", columns="Region", values="Pearson")
+        matrix = matrix.reindex(columns=[r for r in self.regions if r in matrix.columns])
+        if WORLD in matrix.columns:
+            matrix = matrix.sort_values(WORLD, ascending=False)
+        return matrix
@@ -0,0 +1,155 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use("Agg")
+
+import Visualizations
+from figure_cache import FigureCache
+from preprocess import DataPreparation
+
+CONTINENTS = ["Africa", "Europe", "Asia", "North America", "South America", "Oceania"]
+
+# Slugs of the figures already tracked in Visualizations/ that differ from the plain continent name
+TRACKED_SLUGS = {"Most_Common_Death": {"Europe": "Europ"}}
+
+# Prepared data and figure cache of the worker process, set once by _init_worker
+_PREP = None
+_CACHE = None
+
+
+def job(func, output, **kwargs):
+    """A plot job: a function name from Visualizations.py, its keyword arguments and the output file name."""
+    return {"func": func, "kwargs": kwargs, "output": output}
+
+
+def default_jobs():
+    """
+    Every plot type, and every continent for the per-continent plots. File
+    names and arguments follow the figures tracked in Visualizations/ (the
+    calls in Plot.py), so a render replaces them instead of adding
+    near-duplicates.
+    """
+    jobs = [
+        job("plot_global_deathrate_trend", "Trend_Mortality_Global.png"),
+        job("plot_top_and_bottom_causes", "5_TopandLeast_Causes.png"),
+        job("plot_population_age_violin", "Age_Distribution_Continents.png"),
+        job("plot_rising_falling_causes", "Change_Causes_Worldwide.png"),
+        job("plot_top_cause_rank_shift", "Changin_Rank_Worldwide.png", top_n=5),
+        job("plot_top_cause_rank_shift", "Changin_Rank_Germany.png", country="Germany", top_n=5),
+        job("plot_alcohol_vs_deathrate", "Correlation_Alcohol_Liver_Hexbin.png",
+            cause="Cirrhosis and Other Chronic Liver Diseases", continent="Europe"),
+        job("plot_alcohol_vs_deathrate", "Correlation_Alcohol_Drug_Hexbin.png", cause="Drug Use Disorders"),
+        job("plot_alcohol_correlation_matrix", "Correlation_Alcohol_All_Causes.png"),
+        job("plot_joint_kde", "Corr_Diarrheal_Digestive.png",
+            cause_x="Diarrheal Diseases", cause_y="Digestive Diseases", continent="Africa", year=1995),
+    ]
+    for continent in CONTINENTS:
+        slug = continent.replace(" ", "")
+        most_common = TRACKED_SLUGS["Most_Common_Death"].get(continent, slug)
+        jobs.append(job("plot_top_causes_by_continent", f"Most_Common_Death_{most_common}_1990vs2019.png", continent=continent))
+        jobs.append(job("plot_rising_falling_causes", f"Change_Causes_{slug}.png", continent=continent))
+        jobs.append(job("plot_top_cause_rank_shift", f"Changin_Rank_{slug}.png", continent=continent, top_n=5))
+    return jobs
+
+
+def _init_worker(prep, cache_dir=None):
+    global _PREP, _CACHE
+    _PREP = prep
+    _CACHE = FigureCache(cache_dir) if cache_dir else None
+
+
+def _render(spec, out_dir):
+    """Render one job; returns (path, hit) where hit is None without a figure cache."""
+    func = getattr(Visualizations, spec["func"])
+    path = os.path.join(out_dir, spec["output"])
+    if _CACHE is None:
+        return Visualizations.save_figure(func, _PREP, path, **spec["kwargs"]), None
+
+    hits = _CACHE.hits
+    cached = _CACHE.render(func, _PREP, **spec["kwargs"])
+    if cached is None:
+        return None, False
+    shutil.copyfile(cached, path)
+    return path, _CACHE.hits > hits
+
+
+def _warm_aggregates(prep):
+    # Build the shared aggregates before the workers start so they inherit them
+    prep.aggregates.rate_wide
+    prep.aggregates.rate_cube
+    prep.aggregates.alcohol_summary
+    prep.aggregates.trends
+    prep.aggregates.ranks
+    prep.aggregates.changes
+
+
+def render_all(prep, jobs, out_dir, workers=None, cache_dir=None):
+    """
+    Render jobs headless across a process pool and write each figure to out_dir.
+
+    With the fork start method the workers inherit prep from the parent
+    without copying it; elsewhere it is pickled once per worker. With
+    cache_dir, unchanged figures are copied from the FigureCache instead of
+    being rendered.
+
+    Returns:
+    --------
+    list of (job, path or None, error or None, cache hit or None)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    _warm_aggregates(prep)
+
+    context = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(prep, cache_dir)) as pool:
+        futures = {pool.submit(_render, spec, out_dir): spec for spec in jobs}
+        for future in as_completed(futures):
+            spec = futures[future]
+            try:
+                path, hit = future.result()
+                results.append((spec, path, None, hit))
+            except Exception as exc:
+                results.append((spec, None, exc, None))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render all plot variants to image files.")
+    parser.add_argument("--out", default="Visualizations", help="output directory")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--figure-cache", default=None, help="reuse unchanged figures from this cache directory")
+    args = parser.parse_args()
+
+    prep = DataPreparation("data/cause_of_deaths.csv", "data/WPP2024_Population1JanuaryByAge5GroupSex_Medium.csv", "data/total-alcohol-consumption-per-capita-litres-of-pure-alcohol.csv", cache_dir="data/cache")
+
+    start = time.perf_counter()
+    results = render_all(prep, default_jobs(), args.out, args.workers, args.figure_cache)
+    elapsed = time.perf_counter() - start
+
+    for spec, path, error, _ in results:
+        if error is not None:
+            print(f"FAILED {spec['output']}: {error}")
+        elif path is None:
+            print(f"SKIPPED {spec['output']} (no figure drawn)")
+    written = sum(1 for _, path, error, _ in results if path and error is None)
+    print(f"Rendered {written} of {len(results)} figures in {elapsed:.1f}s")
+    if args.figure_cache:
+        hits = sum(1 for *_, hit in results if hit)
+        stats = FigureCache(args.figure_cache).stats()
+        print(f"Figure cache: {hits} hits, {len(results) - hits} misses, "
+              f"{stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
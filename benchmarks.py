@@ -0,0 +1,221 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import os
+import random
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from scipy.stats import gaussian_kde
+
+import Visualizations
+from preprocess import (DEFAULT_YEARS, PARALLEL_MERGE_MIN_ROWS, POP_DTYPES, DataPreparation, merge_partition,
+                        merge_partitioned)
+
+SOURCES = ("data/cause_of_deaths.csv", "data/WPP2024_Population1JanuaryByAge5GroupSex_Medium.csv", "data/total-alcohol-consumption-per-capita-litres-of-pure-alcohol.csv")
+
+
+def _time_per_call(func, calls):
+    start = time.perf_counter()
+    for args in calls:
+        func(*args)
+    return (time.perf_counter() - start) / len(calls)
+
+
+def benchmark_query(prep, n_calls=500, seed=0):
+    """
+    Compare DataPreparation.query against boolean-mask filtering of merged_df
+    for random (cause, year) lookups, as done by the interactive map.
+    """
+    merged = prep.merged_df
+    rng = random.Random(seed)
+    causes = prep.cause_list
+    years = sorted(merged["Year"].unique().tolist())
+    calls = [(rng.choice(causes), rng.choice(years)) for _ in range(n_calls)]
+
+    def mask_filter(cause, year):
+        return merged[(merged["Cause"] == cause) & (merged["Year"] == year)]
+
+    def indexed(cause, year):
+        return prep.query(cause=cause, year=year)
+
+    # Build the index outside the timed loop and check both paths agree
+    cause, year = calls[0]
+    assert len(indexed(cause, year)) == len(mask_filter(cause, year))
+    continent = merged["Continent"].dropna().iloc[0]
+    assert len(prep.query(year=year)) == (merged["Year"] == year).sum()
+    assert len(prep.query(years=years[:3])) == merged["Year"].isin(years[:3]).sum()
+    assert len(prep.query(continent=continent)) == (merged["Continent"] == continent).sum()
+
+    mask_time = _time_per_call(mask_filter, calls)
+    query_time = _time_per_call(indexed, calls)
+
+    print(f"=== QUERY BENCHMARK ({len(merged):,} rows, {n_calls} lookups) ===")
+    print(f"Boolean mask:  {mask_time * 1e3:8.3f} ms per call")
+    print(f"prep.query:    {query_time * 1e3:8.3f} ms per call")
+    print(f"Speedup:       {mask_time / query_time:8.1f}x")
+    return {"mask_ms": mask_time * 1e3, "query_ms": query_time * 1e3}
+
+
+def benchmark_preprocess(paths=SOURCES, core_counts=None):
+    """
+    Time an uncached DataPreparation build serially and with the parallel
+    pipeline at each core count, and check that every prepared table is
+    identical to the serial one. The merge step is also timed on its own
+    with the process pool forced on, which shows whether the data is large
+    enough for PARALLEL_MERGE_MIN_ROWS to send it to the pool.
+    """
+    cpus = os.cpu_count() or 1
+    core_counts = core_counts or sorted({n for n in (2, 4, 8, cpus) if n <= cpus})
+
+    start = time.perf_counter()
+    serial = DataPreparation(*paths, workers=1)
+    serial_time = time.perf_counter() - start
+
+    print(f"=== PREPROCESS BENCHMARK ({len(serial.merged_df):,} merged rows) ===")
+    print(f"{1:>3} core(s): {serial_time:8.2f} s")
+    results = {1: serial_time}
+    for n in core_counts:
+        if n < 2:
+            continue
+        start = time.perf_counter()
+        parallel = DataPreparation(*paths, workers=n)
+        elapsed = time.perf_counter() - start
+        for name in DataPreparation.cache_tables:
+            assert getattr(parallel, name).equals(getattr(serial, name)), f"{name} differs with {n} workers"
+        print(f"{n:>3} core(s): {elapsed:8.2f} s   speedup {serial_time / elapsed:5.2f}x")
+        results[n] = elapsed
+
+    tables = (serial.death_df, serial.pop_total_df, serial.alcohol_df)
+    start = time.perf_counter()
+    merge_partition(*tables)
+    merge_time = time.perf_counter() - start
+    print(f"Merge step ({len(serial.death_df):,} death rows, pool from {PARALLEL_MERGE_MIN_ROWS:,}):")
+    print(f"  in process: {merge_time * 1e3:8.1f} ms")
+    for n in core_counts:
+        if n < 2:
+            continue
+        start = time.perf_counter()
+        merge_partitioned(*tables, n, min_rows=0)
+        elapsed = time.perf_counter() - start
+        print(f"  pool of {n:>2}: {elapsed * 1e3:8.1f} ms   speedup {merge_time / elapsed:5.2f}x")
+    return results
+
+
+def _split_sources(paths, year, directory):
+    """
+    Write every source CSV twice to directory: without the rows of year
+    (base) and with only those rows (delta). Returns (base paths, delta paths).
+    """
+    base, delta = [], []
+    year_cols = ["Year", "Time", "Year"]
+    for path, col in zip(paths, year_cols):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        base_path = os.path.join(directory, f"{stem}_base.csv")
+        delta_path = os.path.join(directory, f"{stem}_{year}.csv")
+        # The population file is large, so it is streamed and reduced to the columns that are read
+        usecols = list(POP_DTYPES) if col == "Time" else None
+        for i, chunk in enumerate(pd.read_csv(path, usecols=usecols, chunksize=250_000)):
+            rows = chunk[col] == year
+            chunk[~rows].to_csv(base_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+            chunk[rows].to_csv(delta_path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+        base.append(base_path)
+        delta.append(delta_path)
+    return base, delta
+
+
+def check_append(paths=SOURCES, year=2019, compact=False, new_year=False):
+    """
+    Build from the sources without one year, append that year, and check
+    that every prepared table is identical to a full build of the sources.
+    Also checks that the appended state is what a later DataPreparation of
+    the same sources loads from the cache, and what a forced rebuild
+    replays.
+
+    With new_year, the base build's year window ends before year, so the
+    append adds a year after the last loaded one and has to extend the
+    window, as when next year's data arrives.
+    """
+    first = DEFAULT_YEARS[0]
+    base_years = (first, year - 1) if new_year else (first, year)
+    start = time.perf_counter()
+    full = DataPreparation(*paths, compact=compact, years=(first, year))
+    full_time = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as directory:
+        base, delta = _split_sources(paths, year, directory)
+        cache_dir = os.path.join(directory, "cache")
+
+        prep = DataPreparation(*base, compact=compact, cache_dir=cache_dir, years=base_years)
+        start = time.perf_counter()
+        stats = prep.append(*delta)
+        append_time = time.perf_counter() - start
+        assert prep.year_window == (first, year), "append did not extend the year window"
+
+        reloaded = DataPreparation(*base, compact=compact, cache_dir=cache_dir, years=base_years)
+        assert reloaded.loaded_from_cache and reloaded.fingerprint == prep.fingerprint, "append did not update the cache entry"
+        assert reloaded.year_window == prep.year_window
+        rebuilt = DataPreparation(*base, compact=compact, cache_dir=cache_dir, years=base_years, force_rebuild=True)
+        for name in DataPreparation.cache_tables:
+            for label, candidate in (("append", prep), ("cache", reloaded), ("replay", rebuilt)):
+                assert getattr(candidate, name).equals(getattr(full, name)), f"{name} differs from a full build ({label})"
+
+    print(f"=== APPEND CHECK ({year}{' as a new year' if new_year else ''}, compact={compact}) ===")
+    print(f"Full build: {full_time:8.2f} s")
+    print(f"Append:     {append_time:8.2f} s, {stats['country_years']:,} country-years recomputed")
+    print("Tables identical to a full build, after a cache reload and after a replayed rebuild")
+    return stats
+
+
+def check_joint_kde(n=5000, seed=0, tolerance=0.05):
+    """
+    Compare the binned FFT density of plot_joint_kde's fast path with
+    scipy's exact gaussian_kde on a correlated, skewed sample: the density on
+    the grid and the contour levels must agree to within tolerance of the
+    peak, and the levels must be valid for contourf.
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.gamma(2.0, 10.0, n)
+    y = 0.6 * x + rng.normal(0, 8, n)
+
+    start = time.perf_counter()
+    xx, yy, density = Visualizations._binned_kde_2d(x, y)
+    binned_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gx, gy = np.meshgrid(xx, yy)
+    exact = gaussian_kde(np.vstack([x, y]))(np.vstack([gx.ravel(), gy.ravel()])).reshape(density.shape)
+    exact_time = time.perf_counter() - start
+
+    density_error = np.abs(density - exact).max() / exact.max()
+    levels = Visualizations._fill_levels(density)
+    exact_levels = Visualizations._fill_levels(exact)
+    level_error = np.abs(levels - exact_levels).max() / exact.max() if len(levels) == len(exact_levels) else np.inf
+
+    fig, ax = plt.subplots()
+    ax.contourf(xx, yy, density, levels=levels)
+    plt.close(fig)
+
+    print(f"=== JOINT KDE CHECK ({n:,} points, {density.size:,} grid cells) ===")
+    print(f"Binned FFT:    {binned_time * 1e3:8.1f} ms")
+    print(f"gaussian_kde:  {exact_time * 1e3:8.1f} ms")
+    print(f"Max density error: {density_error:.2%} of peak, max level error: {level_error:.2%} of peak")
+    assert density_error < tolerance, "binned density deviates from gaussian_kde"
+    assert level_error < tolerance, "contour levels deviate from gaussian_kde"
+    return {"density_error": density_error, "level_error": level_error}
+
+
+if __name__ == "__main__":
+    prep = DataPreparation(*SOURCES, cache_dir="data/cache")
+    benchmark_query(prep)
+    check_joint_kde()
+    check_append()
+    check_append(compact=True)
+    check_append(new_year=True)
+    check_append(new_year=True, compact=True)
+    benchmark_preprocess()
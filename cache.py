@@ -0,0 +1,116 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+META_FILE = "meta.json"
+
+
+def file_fingerprint(paths, version, **options):
+    """
+    Build a cache key from the size and modification time of the input files,
+    the preprocessing version and any options that change the output.
+    """
+    entries = []
+    for path in paths:
+        stat = os.stat(path)
+        entries.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    payload = json.dumps({"files": entries, "version": version, "options": options}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:20]
+
+
+def load_tables(cache_dir, key):
+    """
+    Load a cache entry written by save_tables.
+
+    Returns:
+    --------
+    (dict, dict) or None
+        The tables by name and the stored metadata, or None on a miss.
+    """
+    entry = os.path.join(cache_dir, key)
+    meta_path = os.path.join(entry, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("key") != key:
+        return None
+
+    tables = {name: pd.read_parquet(os.path.join(entry, f"{name}.parquet")) for name in meta["tables"]}
+    return tables, meta
+
+
+def save_tables(cache_dir, key, tables, meta, sources=(), options=None):
+    """
+    Write tables to cache_dir/<key>/ as Parquet files plus a meta.json.
+
+    The entry is written to a temporary directory first and moved into place,
+    so readers never see a half-written entry. Older entries built from the
+    same source files with the same options are removed since they can no
+    longer be hit.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    sources = sorted(os.path.abspath(p) for p in sources)
+    options = options or {}
+    meta = dict(meta, key=key, tables=sorted(tables), sources=sources, options=options)
+
+    tmp = tempfile.mkdtemp(prefix=f".{key}-", dir=cache_dir)
+    for name, df in tables.items():
+        df.to_parquet(os.path.join(tmp, f"{name}.parquet"), index=False)
+    with open(os.path.join(tmp, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, default=str)
+
+    entry = os.path.join(cache_dir, key)
+    if os.path.exists(entry):
+        shutil.rmtree(entry)
+    os.replace(tmp, entry)
+
+    _remove_stale(cache_dir, key, sources, options)
+
+
+def find_entry(cache_dir, sources, options=None):
+    """
+    Metadata of an entry built from the same source files with the same
+    options, whatever its key, or None. Lets a rebuild recover what was
+    recorded in the entry it replaces.
+    """
+    for name, meta in _entries(cache_dir):
+        if _same_build(meta, sorted(os.path.abspath(p) for p in sources), options or {}):
+            return meta
+    return None
+
+
+def _entries(cache_dir):
+    if not os.path.isdir(cache_dir):
+        return
+    for name in sorted(os.listdir(cache_dir)):
+        if name.startswith("."):
+            continue
+        meta_path = os.path.join(cache_dir, name, META_FILE)
+        if not os.path.exists(meta_path):
+            continue
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                yield name, json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def _same_build(meta, sources, options):
+    # Options go through JSON on both sides so tuples and lists compare equal
+    return meta.get("sources") == sources and meta.get("options") == json.loads(json.dumps(options, default=str))
+
+
+def _remove_stale(cache_dir, key, sources, options):
+    for name, meta in list(_entries(cache_dir)):
+        if name != key and _same_build(meta, sources, options):
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
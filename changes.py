@@ -0,0 +1,46 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import numpy as np
+import pandas as pd
+
+
+class ChangeTable:
+    """
+    Percent change of the death rate of every cause between every pair of
+    years, for every region of a RankTable.
+
+    pct has shape (regions, base years, target years, causes) as float32,
+    NaN where either year has no data or the base rate is zero.
+    """
+
+    def __init__(self, pct, regions, years, causes):
+        self.pct = pct
+        self.regions = list(regions)
+        self.years = [int(y) for y in years]
+        self.causes = list(causes)
+
+        self.region_index = {r: i for i, r in enumerate(self.regions)}
+        self.year_index = {y: i for i, y in enumerate(self.years)}
+
+    @classmethod
+    def from_ranks(cls, ranks):
+        values = ranks.values
+        base = np.where(values > 0, values, np.nan)[:, :, None, :]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pct = ((values[:, None, :, :] - base) / base * 100).astype(np.float32)
+        return cls(pct, ranks.regions, ranks.years, ranks.causes)
+
+    def has(self, region, *years):
+        return region in self.region_index and all(y in self.year_index for y in years)
+
+    def change(self, region, base_year, target_year):
+        """Percent change of every cause, as a Series indexed by cause."""
+        row = self.pct[self.region_index[region], self.year_index[base_year], self.year_index[target_year]]
+        return pd.Series(row, index=pd.Index(self.causes, name="Cause"), name="% Change")
+
+    def to_frame(self, base_year, target_year):
+        """Percent change for one year pair as regions x causes."""
+        block = self.pct[:, self.year_index[base_year], self.year_index[target_year]]
+        return pd.DataFrame(block, index=pd.Index(self.regions, name="Region"), columns=self.causes)
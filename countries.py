@@ -0,0 +1,86 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import numpy as np
+import pandas as pd
+
+# Natural Earth ADM0_A3 codes that differ from the ISO3 codes used by the UN and OWID
+NE_ISO3_ALIASES = {
+    "KOS": "XKX",
+    "SAH": "ESH",
+    "PSX": "PSE",
+    "SDS": "SSD",
+}
+
+
+def clean_iso3(codes):
+    """Upper-case ISO3 codes, with anything that is not three letters set to NaN."""
+    codes = pd.Series(codes, dtype="object").str.strip().str.upper()
+    return codes.where(codes.str.fullmatch(r"[A-Z]{3}", na=False))
+
+
+def shapefile_iso3(world):
+    """ISO3 per Natural Earth row: ISO_A3 where valid, else ADM0_A3 mapped through NE_ISO3_ALIASES."""
+    iso = clean_iso3(world["ISO_A3"]) if "ISO_A3" in world.columns else pd.Series(np.nan, index=world.index)
+    adm = clean_iso3(world["ADM0_A3"]).replace(NE_ISO3_ALIASES) if "ADM0_A3" in world.columns else iso
+    return iso.fillna(adm).to_numpy()
+
+
+def build_country_dimension(sources, reference=None):
+    """
+    Build the canonical country table from several sources.
+
+    Parameters:
+    -----------
+    sources : dict
+        Source name -> DataFrame with columns "name" and "iso3". The first
+        source that lists an ISO3 code provides its canonical name.
+    reference : str, optional
+        Source whose coverage the others are checked against, e.g. the
+        population table every join goes through. Defaults to the first source.
+
+    Returns:
+    --------
+    (dim, aliases, unmatched)
+        dim has one row per ISO3 code with country_id (int16), iso3 and country.
+        aliases maps every (source, name) to its iso3 and country_id.
+        unmatched lists names without a valid code or missing from the reference.
+    """
+    reference = reference or next(iter(sources))
+    frames = []
+    for source, df in sources.items():
+        part = pd.DataFrame({"name": df["name"].astype(str).to_numpy(), "iso3": clean_iso3(df["iso3"].to_numpy()).to_numpy()})
+        part = part.drop_duplicates()
+        part.insert(0, "source", source)
+        frames.append(part)
+    aliases = pd.concat(frames, ignore_index=True)
+
+    known = aliases.dropna(subset=["iso3"]).drop_duplicates("iso3")
+    dim = known.sort_values("iso3")[["iso3", "name"]].rename(columns={"name": "country"}).reset_index(drop=True)
+    dim.insert(0, "country_id", np.arange(len(dim), dtype=np.int16))
+
+    aliases = aliases.merge(dim[["iso3", "country_id"]], on="iso3", how="left")
+    aliases["country_id"] = aliases["country_id"].fillna(-1).astype(np.int16)
+
+    no_code = aliases[aliases["iso3"].isna()].assign(reason="no ISO3 code")
+    ref_codes = set(aliases.loc[aliases["source"] == reference, "iso3"].dropna())
+    missing = aliases[aliases["iso3"].notna() & ~aliases["iso3"].isin(ref_codes)].assign(reason=f"not in {reference}")
+    unmatched = pd.concat([no_code, missing], ignore_index=True)[["source", "name", "iso3", "reason"]]
+
+    return dim, aliases, unmatched
+
+
+def attach_country_ids(df, dim, iso3_col="iso3"):
+    """
+    Add country_id (int16, -1 when unmatched) to df and replace its country
+    names with the canonical ones where the code is known.
+    """
+    codes = clean_iso3(df[iso3_col].to_numpy())
+    lookup = dim.set_index("iso3")
+    ids = codes.map(lookup["country_id"])
+    df["country_id"] = ids.fillna(-1).astype(np.int16).to_numpy()
+    canonical = codes.map(lookup["country"])
+    if "country" in df.columns:
+        df["country"] = canonical.fillna(pd.Series(df["country"].astype(str).to_numpy())).to_numpy()
+    return df
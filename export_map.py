@@ -0,0 +1,145 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+
+Write the interactive mortality map as a single static HTML file.
+
+The patch geometry is embedded once, at the coarsest level of detail, and
+every cause x year frame is embedded as uint16 codes per country together
+with its color range. Switching cause or
+year runs in a browser-side callback, so the file needs no Bokeh server.
+"""
+import argparse
+
+import numpy as np
+
+from bokeh.io import output_file, save
+from bokeh.models import Select, ColorBar, LinearColorMapper, HoverTool, ColumnDataSource, CustomJS
+from bokeh.models import Slider
+from bokeh.models import BasicTicker, PrintfTickFormatter
+from bokeh.layouts import column
+from bokeh.plotting import figure
+from bokeh.palettes import OrRd9
+
+from map_data import load_map_data
+
+# uint16 code reserved for missing values, valid codes are 0..QUANT_MAX
+MISSING_CODE = 65535
+QUANT_MAX = 65534
+
+UPDATE_JS = """
+const k = frames.data.key.indexOf(cause.value + "|" + year.value);
+const slot = source.data.slot;
+const rates = new Float64Array(slot.length).fill(NaN);
+if (k >= 0) {
+    const q = frames.data.q[k];
+    const lo = frames.data.low[k];
+    const step = (frames.data.high[k] - lo) / QUANT_MAX;
+    for (let i = 0; i < slot.length; i++) {
+        const v = q[slot[i]];
+        if (v !== MISSING_CODE) {
+            rates[i] = lo + v * step;
+        }
+    }
+    if (!Number.isNaN(lo)) {
+        mapper.low = lo;
+        mapper.high = frames.data.high[k];
+    }
+}
+source.data["Death_Rate_per_100k"] = rates;
+source.change.emit();
+title.text = cause.value + " Death Rate per 100k in " + year.value;
+""".replace("QUANT_MAX", str(QUANT_MAX)).replace("MISSING_CODE", str(MISSING_CODE))
+
+
+def quantize_frames(data, patch_country=None):
+    """
+    Encode every (cause, year) row of the rate matrix as uint16 codes.
+
+    Only countries that have patches (of the finest level unless
+    patch_country is given) are kept. Returns the kept country columns,
+    frame keys, per-frame low/high and the code matrix.
+    """
+    used = np.unique(data.patch_country if patch_country is None else patch_country)
+    rates = data.rate_matrix[:, used]
+    low, high = data.color_ranges()
+
+    span = np.where(high > low, high - low, 1.0)
+    with np.errstate(invalid="ignore"):
+        codes = np.rint((rates - low[:, None]) / span[:, None] * QUANT_MAX)
+    codes = np.where(np.isnan(rates), MISSING_CODE, codes).astype(np.uint16)
+
+    keys = [f"{cause}|{int(year)}" for cause, year in data.frame_index]
+    return used, keys, low, high, codes
+
+
+def build_static_map(data, cause="Tuberculosis", year=2019, level=-1):
+    # A static file cannot swap levels on zoom, so it embeds one; the default is the coarsest
+    geometry = data.levels[level]
+    used, keys, low, high, codes = quantize_frames(data, geometry.patch_country)
+    slot = np.searchsorted(used, geometry.patch_country).astype(np.int32)
+
+    frames = ColumnDataSource(data={"key": keys, "low": low, "high": high, "q": list(codes)})
+
+    k = keys.index(f"{cause}|{year}") if f"{cause}|{year}" in keys else None
+    source = ColumnDataSource(data={
+        "x": geometry.xs,
+        "y": geometry.ys,
+        "country": [data.countries[i] for i in geometry.patch_country],
+        "slot": slot,
+        "Death_Rate_per_100k": data.frame_rates(cause, year, geometry.patch_country),
+    })
+
+    color_mapper = LinearColorMapper(palette=OrRd9[::-1],
+                                     low=low[k] if k is not None else data.rate_range[0],
+                                     high=high[k] if k is not None else data.rate_range[1],
+                                     nan_color="lightgrey")
+
+    cause_select = Select(title="Cause of Death", value=cause, options=data.causes)
+    year_slider = Slider(title="Year", start=min(data.years), end=max(data.years), step=1, value=year)
+
+    p = figure(height=600, width=1200, toolbar_location="left", tools="pan,wheel_zoom,reset",
+               title=f"{cause} Death Rate per 100k in {year}")
+    p.xgrid.grid_line_color = None
+    p.ygrid.grid_line_color = None
+    patches = p.patches("x", "y", source=source,
+                        fill_color={"field": "Death_Rate_per_100k", "transform": color_mapper},
+                        line_color="white", line_width=0.7, fill_alpha=1)
+
+    hover = HoverTool(tooltips=[("Country", "@country"), ("Death Rate", "@Death_Rate_per_100k{0.0}")], renderers=[patches])
+    p.add_tools(hover)
+
+    color_bar = ColorBar(
+        color_mapper=color_mapper,
+        label_standoff=12,
+        location=(0, 0),
+        title="Rate per 100k",
+        ticker=BasicTicker(),
+        formatter=PrintfTickFormatter(format="%.1f")
+    )
+    p.add_layout(color_bar, "right")
+
+    callback = CustomJS(args=dict(source=source, frames=frames, mapper=color_mapper,
+                                  cause=cause_select, year=year_slider, title=p.title),
+                        code=UPDATE_JS)
+    cause_select.js_on_change("value", callback)
+    year_slider.js_on_change("value", callback)
+
+    return column(cause_select, p, year_slider)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the mortality map as a standalone HTML file.")
+    parser.add_argument("output", nargs="?", default="mortality_map.html")
+    parser.add_argument("--level", type=int, default=-1,
+                        help="Level of detail to embed, 0 is the finest and -1 (default) the coarsest")
+    args = parser.parse_args()
+
+    layout = build_static_map(load_map_data(), level=args.level)
+    output_file(args.output, title="Interactive Global Mortality Map")
+    save(layout)
+    print(f"Map written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
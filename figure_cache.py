@@ -0,0 +1,139 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import functools
+import hashlib
+import importlib
+import inspect
+import json
+import os
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+from Visualizations import save_figure
+
+FIGURE_CACHE_DIR = "data/figure_cache"
+
+# Modules whose code shapes a figure besides the plot function itself: its
+# helpers and the aggregates it draws from
+CODE_MODULES = ["Visualizations", "aggregates", "rate_cube", "ranks", "changes", "trends", "alcohol_summary"]
+
+
+def library_versions():
+    return {
+        "matplotlib": matplotlib.__version__,
+        "seaborn": sns.__version__,
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def code_fingerprint(modules=tuple(CODE_MODULES)):
+    """Hash of the source files of the given modules."""
+    digest = hashlib.sha256()
+    for name in modules:
+        with open(inspect.getsourcefile(importlib.import_module(name)), "rb") as f:
+            digest.update(name.encode("utf-8") + b"\0" + f.read())
+    return digest.hexdigest()
+
+
+class FigureCache:
+    """
+    Content-addressed store of rendered figures.
+
+    An image is keyed on the plot function (name and source), the source of
+    the modules in CODE_MODULES and of the function's own module, its
+    arguments, the plotting library versions, the fingerprint of the prepared
+    data and the rate column the aggregates are built on, so a hit can be returned
+    without rendering. Files are evicted least recently used first once the
+    store grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir=FIGURE_CACHE_DIR, max_bytes=512 * 1024 * 1024, fmt="png"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, plot_func, prep, dpi=100, **kwargs):
+        source = inspect.getsource(plot_func)
+        payload = {
+            "func": f"{plot_func.__module__}.{plot_func.__qualname__}",
+            "source": hashlib.sha256(source.encode("utf-8")).hexdigest(),
+            "code": code_fingerprint(tuple(dict.fromkeys(CODE_MODULES + [plot_func.__module__]))),
+            "kwargs": kwargs,
+            "dpi": dpi,
+            "versions": library_versions(),
+            "data": prep.fingerprint,
+            "rate_column": prep.aggregates.rate_column,
+        }
+        text = json.dumps(payload, sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def render(self, plot_func, prep, dpi=100, **kwargs):
+        """
+        Return the path of the cached image for plot_func(prep, **kwargs),
+        rendering and storing it first on a miss. Returns None when the
+        function draws no figure.
+        """
+        path = os.path.join(self.cache_dir, f"{self.key(plot_func, prep, dpi, **kwargs)}.{self.fmt}")
+        if os.path.exists(path):
+            self.hits += 1
+            # Touch the file so eviction sees it as recently used
+            os.utime(path)
+            return path
+
+        self.misses += 1
+        tmp = f"{path}.{os.getpid()}.tmp.{self.fmt}"
+        if save_figure(plot_func, prep, tmp, dpi=dpi, **kwargs) is None:
+            return None
+        os.replace(tmp, path)
+        self._evict(keep=path)
+        return path
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(f".{self.fmt}") or ".tmp." in name:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(self.cache_dir, name)))
+        return entries
+
+    def _evict(self, keep=None):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
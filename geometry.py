@@ -0,0 +1,104 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import os
+import pickle
+import tempfile
+
+import numpy as np
+from shapely.geometry import Polygon, MultiPolygon
+
+import cache
+
+# Simplification tolerances in degrees, finest first
+LOD_TOLERANCES = (0.0, 0.01, 0.05, 0.2)
+GEOMETRY_CACHE_DIR = "data/geometry_cache"
+GEOMETRY_VERSION = 1
+
+
+def geo_to_coords(geometries):
+    """Return patch x/y lists and, per patch, the index of the geometry it belongs to."""
+    xs, ys, patch_country = [], [], []
+    for i, geom in enumerate(geometries):
+        if isinstance(geom, Polygon):
+            coords = [geom.exterior.coords]
+        elif isinstance(geom, MultiPolygon):
+            coords = [p.exterior.coords for p in geom.geoms]
+        else:
+            continue
+
+        for ring in coords:
+            x, y = zip(*ring)
+            xs.append(list(x))
+            ys.append(list(y))
+            patch_country.append(i)
+    return xs, ys, np.array(patch_country, dtype=np.int64)
+
+
+class GeometryLevel:
+    """Patch coordinates of the map at one simplification tolerance."""
+
+    def __init__(self, tolerance, xs, ys, patch_country):
+        self.tolerance = tolerance
+        self.xs = xs
+        self.ys = ys
+        self.patch_country = patch_country
+        # Bounding box per patch: minx, miny, maxx, maxy
+        self.bounds = np.array([[min(x), min(y), max(x), max(y)] for x, y in zip(xs, ys)], dtype=np.float64).reshape(-1, 4)
+        self.n_points = sum(len(x) for x in xs)
+
+    def visible(self, x0, x1, y0, y1):
+        """Indices of the patches whose bounding box intersects the view."""
+        b = self.bounds
+        mask = (b[:, 2] >= x0) & (b[:, 0] <= x1) & (b[:, 3] >= y0) & (b[:, 1] <= y1)
+        return np.flatnonzero(mask)
+
+
+def build_levels(world, source_path, tolerances=LOD_TOLERANCES, cache_dir=GEOMETRY_CACHE_DIR):
+    """
+    Simplify the world geometry at every tolerance and extract the patches.
+
+    Each level is cached on disk under a key of the shapefile fingerprint and
+    the tolerance, so later runs only unpickle the coordinates.
+    """
+    levels = []
+    for tolerance in sorted(tolerances):
+        key = cache.file_fingerprint([source_path], GEOMETRY_VERSION, tolerance=tolerance)
+        path = os.path.join(cache_dir, f"{key}.pkl") if cache_dir else None
+
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                xs, ys, patch_country = pickle.load(f)
+        else:
+            geoms = world.geometry if tolerance == 0 else world.geometry.simplify(tolerance, preserve_topology=True)
+            xs, ys, patch_country = geo_to_coords(geoms)
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                # Written to a temporary file and moved into place, so a reader never unpickles a partial file
+                fd, tmp = tempfile.mkstemp(prefix=f".{key}-", suffix=".pkl", dir=cache_dir)
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        pickle.dump((xs, ys, patch_country), f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+
+        patch_country.setflags(write=False)
+        levels.append(GeometryLevel(tolerance, xs, ys, patch_country))
+    return levels
+
+
+def choose_level(levels, x_span, width_px):
+    """
+    Pick the coarsest level whose tolerance is still below one screen pixel.
+
+    levels must be sorted finest first, as returned by build_levels.
+    """
+    degrees_per_pixel = x_span / max(width_px, 1)
+    chosen = levels[0]
+    for level in levels:
+        if level.tolerance <= degrees_per_pixel:
+            chosen = level
+    return chosen
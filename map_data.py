@@ -0,0 +1,252 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+from preprocess import load_population
+from geometry import build_levels
+from countries import build_country_dimension, attach_country_ids, shapefile_iso3
+
+DEATH_PATH = "cause_of_deaths.csv"
+POP_PATH = "WPP2024_Population1JanuaryByAge5GroupSex_Medium.csv"
+# Natural Earth shapefiles, finest first; the first one present is used
+SHAPE_PATHS = [
+    "data/ne_10m_admin_0_countries/ne_10m_admin_0_countries.shp",
+    "data/ne_50m_admin_0_countries/ne_50m_admin_0_countries.shp",
+    "data/ne_110m_admin_0_countries/ne_110m_admin_0_countries.shp",
+]
+SHAPE_PATH = SHAPE_PATHS[-1]
+
+
+def load_merged(world, death_path=DEATH_PATH, pop_path=POP_PATH):
+    """
+    Death rates per 100k per country, year and cause for the map.
+
+    Deaths, population and the shapefile rows are joined on an integer
+    country_id derived from ISO3 codes. world gets a country_id column.
+
+    Returns:
+    --------
+    (pd.DataFrame, pd.DataFrame)
+        The merged rates and the names that could not be matched.
+    """
+    death_df = pd.read_csv(death_path)
+    pop_df, _ = load_population(pop_path)
+
+    # Prepare population (rows already filtered while streaming)
+    pop_df = pop_df[["Location", "ISO3_code", "Time", "PopTotal"]]
+    pop_df.columns = ["country", "iso3", "Year", "Population_Total"]
+
+    # Multiply by 1000 (data is in thousands)
+    pop_df["Population_Total"] *= 1000
+
+    # Prepare death data
+    death_df = death_df.rename(columns={"Country/Territory": "country", "Code": "iso3"})
+    cause_cols = death_df.columns.difference(["country", "Year", "iso3"])
+    death_long = death_df.melt(id_vars=["country", "iso3", "Year"], value_vars=cause_cols, var_name="Cause", value_name="Deaths")
+    death_long["Deaths"] = pd.to_numeric(death_long["Deaths"], errors="coerce")
+
+    # Integer join keys shared by all three sources
+    world["iso3"] = shapefile_iso3(world)
+    dim, _, unmatched = build_country_dimension({
+        "population": pop_df[["country", "iso3"]].drop_duplicates().rename(columns={"country": "name"}),
+        "deaths": death_long[["country", "iso3"]].drop_duplicates().rename(columns={"country": "name"}),
+        "shapefile": world[["country", "iso3"]].rename(columns={"country": "name"}),
+    }, reference="population")
+    attach_country_ids(pop_df, dim)
+    attach_country_ids(death_long, dim)
+    world["country_id"] = attach_country_ids(pd.DataFrame({"iso3": world["iso3"].to_numpy()}), dim)["country_id"].to_numpy()
+
+    # Group to get single value per country-year
+    pop_df = pop_df[pop_df["country_id"] >= 0]
+    pop_df = pop_df.groupby(["country_id", "Year"], as_index=False)["Population_Total"].sum()
+
+    merged = death_long.merge(pop_df, on=["country_id", "Year"], how="left")
+    merged = merged[merged["Population_Total"].notna() & (merged["Population_Total"] > 0)]
+    merged = merged[merged["Deaths"].notna()]
+    merged["Death_Rate_per_100k"] = (merged["Deaths"] / merged["Population_Total"]) * 100000
+    return merged, unmatched
+
+
+def find_shapefile():
+    for path in SHAPE_PATHS:
+        if os.path.exists(path):
+            return path
+    return SHAPE_PATH
+
+
+def load_world(shape_path=SHAPE_PATH):
+    world = gpd.read_file(shape_path)
+    world = world.rename(columns={"ADMIN": "country"})
+    world = world.to_crs("EPSG:4326")
+    return world[world.geometry.notna()].reset_index(drop=True)
+
+
+class MapData:
+    """
+    Read-only data behind the interactive map: patch geometry at several
+    levels of detail and a (cause, year) x country rate matrix aligned to
+    the shapefile rows through their country_id.
+
+    xs, ys and patch_country are those of the finest level.
+    """
+
+    def __init__(self, merged, world, levels, unmatched=None):
+        self.countries = world["country"].tolist()
+        self.unmatched = unmatched
+        self.levels = levels
+        finest = levels[0]
+        self.xs, self.ys, self.patch_country = finest.xs, finest.ys, finest.patch_country
+        self.patch_names = [self.countries[i] for i in self.patch_country]
+
+        rate_table = merged.pivot_table(index=["Cause", "Year"], columns="country_id", values="Death_Rate_per_100k")
+        rate_table = rate_table.reindex(columns=world["country_id"].to_numpy())
+        self.rate_matrix = rate_table.to_numpy()
+        self.frame_index = {key: i for i, key in enumerate(rate_table.index)}
+
+        self.causes = sorted(merged["Cause"].unique().tolist())
+        self.years = sorted(merged["Year"].unique().tolist())
+        self.rate_range = (merged["Death_Rate_per_100k"].min(), merged["Death_Rate_per_100k"].max())
+
+        # Shared between sessions, so make accidental writes fail loudly
+        self.rate_matrix.setflags(write=False)
+        self._color_ranges = {}
+
+    def color_ranges(self, robust=False, percentiles=(2, 98)):
+        """
+        Color domain (low, high) for every (cause, year) frame, in frame_index order.
+
+        Computed in one pass over the rate matrix, restricted to countries that
+        are drawn. With robust=True the given percentiles are used instead of
+        min and max, so single outliers do not wash out the map.
+        """
+        key = (robust, tuple(percentiles))
+        if key not in self._color_ranges:
+            rates = self.rate_matrix[:, np.unique(self.patch_country)]
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                if robust:
+                    low, high = np.nanpercentile(rates, percentiles, axis=1)
+                else:
+                    low, high = np.nanmin(rates, axis=1), np.nanmax(rates, axis=1)
+            self._color_ranges[key] = (low, high)
+        return self._color_ranges[key]
+
+    def color_range(self, cause, year, robust=False):
+        row = self.frame_index.get((cause, year))
+        if row is None:
+            return self.rate_range
+        low, high = self.color_ranges(robust)
+        if np.isnan(low[row]):
+            return self.rate_range
+        return low[row], high[row]
+
+    def country_rates(self, cause, year):
+        # Per-country rates for one (cause, year), NaN where there is no data
+        row = self.frame_index.get((cause, year))
+        if row is None:
+            return np.full(len(self.countries), np.nan)
+        return self.rate_matrix[row]
+
+    def frame_rates(self, cause, year, patch_country=None):
+        # Per-patch rates for one (cause, year), for the finest level unless patches are given
+        if patch_country is None:
+            patch_country = self.patch_country
+        return self.country_rates(cause, year)[patch_country]
+
+
+class FrameCache:
+    """
+    Bounded LRU cache of ready-to-send frames (per-country rates, low, high).
+
+    Per-country rates are turned into patch rates for whatever level of detail
+    and viewport is on screen by indexing with that level's patch_country.
+
+    Every lookup also schedules the neighbouring years of the same cause on a
+    background thread, so stepping or playing through the years hits the cache.
+    """
+
+    def __init__(self, data, maxsize=128, prefetch=2, robust=False):
+        self.data = data
+        self.maxsize = maxsize
+        self.prefetch = prefetch
+        self.robust = robust
+        self._frames = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-prefetch")
+        self._years = set(data.years)
+
+    def _build(self, cause, year):
+        rates = np.array(self.data.country_rates(cause, year))
+        rates.setflags(write=False)
+        low, high = self.data.color_range(cause, year, self.robust)
+        return rates, low, high
+
+    def _store(self, key, frame):
+        with self._lock:
+            self._frames[key] = frame
+            self._frames.move_to_end(key)
+            self._pending.discard(key)
+            while len(self._frames) > self.maxsize:
+                self._frames.popitem(last=False)
+
+    def _fill(self, cause, year):
+        self._store((cause, year), self._build(cause, year))
+
+    def get(self, cause, year):
+        key = (cause, year)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+        if frame is None:
+            frame = self._build(cause, year)
+            self._store(key, frame)
+        self._schedule_neighbours(cause, year)
+        return frame
+
+    def _schedule_neighbours(self, cause, year):
+        for step in range(1, self.prefetch + 1):
+            for neighbour in (year + step, year - step):
+                key = (cause, neighbour)
+                if neighbour not in self._years:
+                    continue
+                with self._lock:
+                    if key in self._frames or key in self._pending:
+                        continue
+                    self._pending.add(key)
+                self._executor.submit(self._fill, cause, neighbour)
+
+
+@lru_cache(maxsize=None)
+def load_map_data():
+    """
+    Load and prepare the map data once per process.
+
+    `bokeh serve` runs Interactive.py for every browser session, but imported
+    modules are shared, so all sessions get the same MapData instance.
+    """
+    shape_path = find_shapefile()
+    world = load_world(shape_path)
+    merged, unmatched = load_merged(world)
+    if not unmatched.empty:
+        print(f"{len(unmatched)} country names could not be joined on ISO3:")
+        print(unmatched.to_string(index=False))
+    return MapData(merged, world, build_levels(world, shape_path), unmatched)
+
+
+@lru_cache(maxsize=None)
+def load_frame_cache(robust=False):
+    """Process-wide FrameCache over load_map_data(), shared by all sessions."""
+    return FrameCache(load_map_data(), robust=robust)
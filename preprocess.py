@@ -2,10 +2,250 @@
 Copyright C Philipp Mc Guire, 2025
 Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html 
 """
+import multiprocessing as mp
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
 import pycountry_convert as pc
 
+import cache
+from age_standard import MODEL_ADJUSTED_RATE, adjusted_rates, adjustment_factors, standard_weights
+from aggregates import AggregateStore
+from countries import build_country_dimension, attach_country_ids
+
+# Bump whenever a change to the pipeline alters the prepared tables
+PREPROCESS_VERSION = 8
+
+# Default window of years kept from the population file; alcohol data starts in 2000
+DEFAULT_YEARS = (1990, 2019)
+ALCOHOL_FIRST_YEAR = 2000
+
+# Columns stored as float32 in compact mode (pop_total_df keeps float64, it is small and feeds every rate)
+COMPACT_FLOAT_COLUMNS = ["Population_Male", "Population_Female", "Population_Total", "Death_Rate_per_100k", MODEL_ADJUSTED_RATE]
+
+# Death rows from which merge_partitioned uses a process pool; the bundled data (~200k rows)
+# merges in milliseconds, well below the cost of starting a pool
+PARALLEL_MERGE_MIN_ROWS = 5_000_000
+
+# Columns read from the WPP population file and their dtypes
+POP_DTYPES = {
+    "Location": "object",
+    "ISO3_code": "object",
+    "Time": "int16",
+    "AgeGrp": "object",
+    "PopMale": "float64",
+    "PopFemale": "float64",
+    "PopTotal": "float64",
+    "Variant": "category",
+    "LocTypeID": "int8",
+}
+POP_KEEP = ["Location", "ISO3_code", "Time", "AgeGrp", "PopMale", "PopFemale", "PopTotal"]
+
+
+def load_population(path, years=DEFAULT_YEARS, variant="Medium", loc_type=4, chunksize=250_000):
+    """
+    Stream the WPP population CSV, keeping only the needed columns and rows.
+
+    Each chunk is filtered on Variant, Time (unless years is None) and
+    LocTypeID as soon as it is read, so peak memory depends on the filtered
+    output rather than the full file.
+
+    Returns:
+    --------
+    (pd.DataFrame, dict)
+        The filtered rows and a dict with "rows_read" and "rows_kept".
+    """
+    parts = []
+    rows_read = 0
+    reader = pd.read_csv(path, usecols=list(POP_DTYPES), dtype=POP_DTYPES, chunksize=chunksize)
+    for chunk in reader:
+        rows_read += len(chunk)
+        mask = (chunk["Variant"] == variant) & (chunk["LocTypeID"] == loc_type)
+        if years is not None:
+            mask &= chunk["Time"].between(*years)
+        parts.append(chunk.loc[mask, POP_KEEP])
+
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=POP_KEEP)
+    return df, {"rows_read": rows_read, "rows_kept": len(df)}
+
+
+# Deterministic row order of the prepared tables, shared by full builds and appends
+SORT_KEYS = {
+    "pop_df": ["country", "Year"],
+    "death_df": ["Cause", "country", "Year"],
+    "alcohol_df": ["country", "iso3", "Year"],
+    "pop_total_df": ["country_id", "Year"],
+    "merged_df": ["Cause", "country", "Year"],
+    "adjustment_df": ["country_id", "Year"],
+}
+
+
+def sort_rows(df, name):
+    # Stable, so rows with equal keys (the age groups of a country-year) keep their order
+    return df.sort_values(SORT_KEYS[name], kind="mergesort").reset_index(drop=True)
+
+
+def _order_codes(col):
+    # Integer codes that order like sort_values orders the column, missing values last
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        codes = col.cat.codes.to_numpy(dtype=np.int64)
+        return np.where(codes < 0, len(col.cat.categories), codes)
+    if pd.api.types.is_integer_dtype(col.dtype):
+        values = col.to_numpy(dtype=np.int64)
+        return values - values.min() if len(values) else values
+    codes, uniques = pd.factorize(col, sort=True)
+    return np.where(codes < 0, len(uniques), codes).astype(np.int64)
+
+
+def merge_sorted(table, rows, name):
+    """
+    Insert rows into table, both already in sort_rows order, and return the
+    result in sort_rows order without sorting the whole table again.
+
+    Every row gets one int64 key from the codes of its sort columns, and
+    the rows go in at np.searchsorted positions of their keys, after table
+    rows with equal keys, exactly as a stable sort of the concatenation
+    would place them. Falls back to sort_rows when a categorical key
+    column of table has a different dtype in rows.
+    """
+    keys = SORT_KEYS[name]
+    combined = pd.concat([table, rows], ignore_index=True)
+    if any(isinstance(table[k].dtype, pd.CategoricalDtype) and combined[k].dtype != table[k].dtype for k in keys):
+        return sort_rows(combined, name)
+
+    key = np.zeros(len(combined), dtype=np.int64)
+    for k in keys:
+        codes = _order_codes(combined[k])
+        key = key * (int(codes.max()) + 1 if len(codes) else 1) + codes
+    n = len(table)
+    positions = np.searchsorted(key[:n], key[n:], side="right")
+    order = np.insert(np.arange(n), positions, np.arange(n, len(combined)))
+    return combined.take(order).reset_index(drop=True)
+
+
+def prep_population(df):
+    # Rows and columns were already filtered while streaming in load_population
+    df = df.rename(columns={
+        "Location": "country",
+        "ISO3_code": "iso3",
+        "Time": "Year",
+        "AgeGrp": "Age_Group",
+        "PopMale": "Population_Male",
+        "PopFemale": "Population_Female",
+        "PopTotal": "Population_Total"
+    })
+
+    df["Population_Male"] *= 1000
+    df["Population_Female"] *= 1000
+    df["Population_Total"] *= 1000
+    return df
+
+
+def prep_deaths(df):
+    df = df.rename(columns={"Country/Territory": "country", "Code": "iso3"})
+    cause_cols = df.columns.difference(["country", "Year", "iso3"])
+    df = df.melt(
+        id_vars=["country", "iso3", "Year"],
+        value_vars=cause_cols,
+        var_name="Cause",
+        value_name="Deaths"
+    )
+    df["Deaths"] = pd.to_numeric(df["Deaths"], errors="coerce")
+    return df
+
+
+def alcohol_years(years):
+    # Alcohol window inside the population window
+    return max(years[0], ALCOHOL_FIRST_YEAR), years[1]
+
+
+def prep_alcohol(df, years=alcohol_years(DEFAULT_YEARS)):
+    if years is not None:
+        df = df[df["Year"].between(*years)]
+    df = df.rename(columns={
+        "Entity": "country",
+        "Code": "iso3",
+        "Total alcohol consumption per capita (liters of pure alcohol, projected estimates, 15+ years of age)": "Alcohol_Consumption_Liters"
+    })
+    df = df[["country", "iso3", "Year", "Alcohol_Consumption_Liters"]]
+    # Rows without an ISO3 code are OWID regional aggregates, not countries
+    return df.groupby(["country", "iso3", "Year"]).mean().reset_index()
+
+
+def population_totals(pop_df):
+    # One row per country-year; pop_df keeps the age-resolved detail
+    pop = pop_df[pop_df["country_id"] >= 0]
+    return pop.groupby(["country_id", "country", "iso3", "Year"], as_index=False, sort=True, observed=True)[
+        ["Population_Male", "Population_Female", "Population_Total"]
+    ].sum()
+
+
+def merge_partition(death_df, pop_total_df, alcohol_df):
+    """Join deaths to population and alcohol and compute the crude rate, for any subset of country-years."""
+    # Joins run on the integer country_id, names are only carried along
+    keys = ["country_id", "Year"]
+    pop_total = pop_total_df[keys + ["Population_Male", "Population_Female", "Population_Total"]]
+    alcohol = alcohol_df.loc[alcohol_df["country_id"] >= 0, keys + ["Alcohol_Consumption_Liters"]]
+
+    merged = death_df.merge(pop_total, on=keys, how="left")
+    merged = merged[merged["Population_Total"].notna() & (merged["Population_Total"] > 0)]
+    merged["Death_Rate_per_100k"] = (merged["Deaths"] / merged["Population_Total"]) * 100000
+    merged = merged.merge(alcohol, on=keys, how="left")
+    return merged.reset_index(drop=True)
+
+
+def _merge_chunk(args):
+    return merge_partition(*args)
+
+
+def merge_partitioned(death_df, pop_total_df, alcohol_df, workers, min_rows=PARALLEL_MERGE_MIN_ROWS):
+    """
+    merge_partition split by country_id across a process pool.
+
+    Every country's rows go to one chunk, so the joins never cross chunks,
+    and the chunks are concatenated in order. After sort_rows the result is
+    identical to a single merge_partition call. Rows without a country_id
+    never join a population and are left out, as in merge_partition.
+
+    With fewer than min_rows death rows the merge runs in this process:
+    starting the pool and pickling the chunks then costs more than the
+    merge itself (benchmarks.benchmark_preprocess times both).
+    """
+    if len(death_df) < min_rows:
+        return merge_partition(death_df, pop_total_df, alcohol_df)
+    ids = np.unique(death_df.loc[death_df["country_id"] >= 0, "country_id"].to_numpy())
+    chunks = [c for c in np.array_split(ids, workers) if len(c)]
+    if len(chunks) < 2:
+        return merge_partition(death_df, pop_total_df, alcohol_df)
+
+    tasks = [(death_df[death_df["country_id"].isin(c)], pop_total_df[pop_total_df["country_id"].isin(c)],
+              alcohol_df[alcohol_df["country_id"].isin(c)]) for c in chunks]
+    context = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=len(tasks), mp_context=context) as pool:
+        parts = list(pool.map(_merge_chunk, tasks))
+    return pd.concat(parts, ignore_index=True)
+
+
+def country_year_keys(df):
+    # (country_id, Year) pairs as a MultiIndex with int64 levels
+    return pd.MultiIndex.from_arrays([df["country_id"].to_numpy(dtype=np.int64), df["Year"].to_numpy(dtype=np.int64)])
+
+
+def in_partitions(df, partitions, cols=("country", "Year")):
+    """Boolean mask of the rows of df whose (country, Year) pair is in partitions."""
+    country, year = cols
+    names = set(name for name, _ in partitions)
+    mask = df[country].isin(names).to_numpy()
+    if mask.any():
+        keys = pd.MultiIndex.from_arrays([df.loc[mask, country].astype(str).to_numpy(),
+                                          df.loc[mask, year].to_numpy(dtype=np.int64)])
+        mask[mask] = keys.isin(partitions)
+    return mask
+
+
 class DataPreparation:
     # Manual fallback for country -> continent mapping
     manual_continent_map = {
@@ -28,82 +268,555 @@ class DataPreparation:
         "Western Sahara": "Africa"
     }
 
-    def __init__(self, death_path, pop_path, alcohol_path):
-        self.death_df = pd.read_csv(death_path)
-        self.pop_df = pd.read_csv(pop_path, low_memory=False)
-        self.alcohol_df = pd.read_csv(alcohol_path)
-        self._preprocess_all()
+    # Tables written to and restored from the on-disk cache
+    cache_tables = ["merged_df", "pop_df", "pop_total_df", "death_df", "alcohol_df", "adjustment_df",
+                    "country_dim", "country_aliases", "unmatched_countries"]
+
+    def __init__(self, death_path, pop_path, alcohol_path, cache_dir=None, force_rebuild=False, compact=False,
+                 age_standard=None, workers=1, years=DEFAULT_YEARS, verbose=False):
+        self.source_paths = [death_path, pop_path, alcohol_path]
+        self.cache_dir = cache_dir
+        self.compact = compact
+        # Opt-in model-adjusted rate column ("who" or a standard year), see age_standard.py
+        self.age_standard = age_standard
+        # First and last year read from the population file, alcohol uses alcohol_years(years).
+        # year_window starts there and grows with the years that append adds.
+        self.years = (int(years[0]), int(years[1]))
+        self.year_window = self.years
+        # Worker count for the parallel pipeline, 1 runs serially and None uses every core
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.memory_report = None
+        # Entry of the source files in the cache; fingerprint identifies the data including appended deltas
+        self.cache_key = cache.file_fingerprint(self.source_paths, PREPROCESS_VERSION, **self._cache_options())
+        self.fingerprint = self.cache_key
+        self.appended = []
+        self.pop_load_stats = None
+        self.loaded_from_cache = False
+
+        if not (cache_dir and not force_rebuild and self._load_cache()):
+            if self.workers > 1:
+                self._load_sources_parallel(death_path, pop_path, alcohol_path)
+            else:
+                self.death_df = pd.read_csv(death_path)
+                self.pop_df, self.pop_load_stats = load_population(pop_path, self.years)
+                self.alcohol_df = pd.read_csv(alcohol_path)
+                self._prep_population()
+                self._prep_deaths()
+                self._prep_alcohol()
+            self._preprocess_all()
+
+            if cache_dir:
+                self._replay_appended()
+                self._save_cache()
+
+        # Shared, lazily computed aggregates for the plotting functions
+        self.aggregates = AggregateStore(self)
+        self._query_df = None
+
+        if verbose:
+            self.report_load_stats()
+            self.report_country_coverage()
+
+    def _cache_options(self):
+        # Constructor options that change the prepared tables
+        return {"compact": self.compact, "age_standard": self.age_standard, "years": list(self.years)}
+
+    def use_rate_column(self, column):
+        """
+        Base the shared aggregates (rate cube, trends, ranks, changes, alcohol
+        summary) on another rate column of merged_df, e.g. MODEL_ADJUSTED_RATE.
+        """
+        self.aggregates = AggregateStore(self, rate_column=column)
+
+    def _load_cache(self):
+        hit = cache.load_tables(self.cache_dir, self.cache_key)
+        if hit is None:
+            return False
+        tables, meta = hit
+        for name in self.cache_tables:
+            setattr(self, name, tables[name])
+        self.cause_list = meta["cause_list"]
+        pairs = pd.concat([self.merged_df[["country", "Continent"]], self.pop_df[["country", "Continent"]]])
+        pairs = pairs.astype(str).drop_duplicates("country")
+        self.continent_lookup = pairs.set_index("country")["Continent"].sort_index()
+        self.pop_load_stats = meta.get("pop_load_stats")
+        self.appended = meta.get("appended", [])
+        self.year_window = tuple(meta.get("year_window", self.years))
+        self.fingerprint = meta.get("fingerprint", self.cache_key)
+        self.loaded_from_cache = True
+        return True
+
+    def _save_cache(self):
+        tables = {name: getattr(self, name) for name in self.cache_tables}
+        meta = {"version": PREPROCESS_VERSION, "cause_list": self.cause_list, "pop_load_stats": self.pop_load_stats,
+                "source_paths": self.source_paths, "appended": self.appended, "fingerprint": self.fingerprint,
+                "year_window": list(self.year_window)}
+        cache.save_tables(self.cache_dir, self.cache_key, tables, meta,
+                          sources=self.source_paths, options=self._cache_options())
+
+    def _replay_appended(self):
+        # A rebuild of an entry that had deltas appended applies them again, in their original order
+        previous = cache.find_entry(self.cache_dir, self.source_paths, self._cache_options())
+        for delta in (previous or {}).get("appended", []):
+            paths = [p for p in delta.values() if p]
+            missing = [p for p in paths if not os.path.exists(p)]
+            if missing:
+                warnings.warn(f"Cannot replay appended delta, missing {', '.join(missing)}", stacklevel=3)
+                continue
+            self._apply_delta(**delta)
+            self._record_delta(delta)
+
+    def _record_delta(self, delta):
+        self.appended = self.appended + [delta]
+        paths = self.source_paths + [p for d in self.appended for p in d.values() if p]
+        self.fingerprint = cache.file_fingerprint(paths, PREPROCESS_VERSION, **self._cache_options())
+
+    def append(self, death_path=None, pop_path=None, alcohol_path=None):
+        """
+        Ingest new or revised (country, year) partitions without a full rebuild.
+
+        Each file has the layout of the matching source CSV but holds only the
+        changed country-years. Their rows replace the prepared rows of the same
+        country-years. Melt, merge, rate, model adjustment and continent steps
+        then run only on the affected country-years, in float64 as in a full
+        build, and are merged into the existing tables in the deterministic
+        order of a full build, by merging the sorted rows into each table rather
+        than sorting it again. Years after the year window are new years and
+        extend it (year_window); rows before its start are dropped (deaths are
+        kept but get no rate) with a warning. The aggregates and the query
+        index are reset.
+
+        With a cache directory, the entry of the source files is updated and
+        records the delta files, so a later DataPreparation of the same sources
+        loads the appended state, and a rebuild replays the deltas.
+
+        A delta that adds ISO3 codes changes the country ids, so the join
+        steps then rerun on every country-year (still without reading or
+        melting the full CSVs). In compact mode, new categories (countries,
+        causes) also re-compact the full tables. With a standard year that the
+        delta revises, every adjusted rate is recomputed from pop_df and
+        merged_df, which are float32 in compact mode.
+
+        Returns:
+        --------
+        dict
+            Number of partitions replaced per table and of merged country-years recomputed.
+        """
+        delta = {"death_path": death_path, "pop_path": pop_path, "alcohol_path": alcohol_path}
+        stats = self._apply_delta(**delta)
+        if not stats:
+            return stats
+
+        self._record_delta(delta)
+        self.loaded_from_cache = False
+        self.aggregates = AggregateStore(self, rate_column=self.aggregates.rate_column)
+        self._query_df = None
+        if self.cache_dir:
+            self._save_cache()
+        return stats
+
+    def _apply_delta(self, death_path=None, pop_path=None, alcohol_path=None):
+        deltas = {}
+        if death_path:
+            deltas["death_df"] = prep_deaths(pd.read_csv(death_path))
+        if pop_path:
+            deltas["pop_df"] = prep_population(load_population(pop_path, years=None)[0])
+        if alcohol_path:
+            deltas["alcohol_df"] = prep_alcohol(pd.read_csv(alcohol_path), years=None)
+
+        # Years after the window are new years and extend it; rows before its start are not kept
+        last = max([self.year_window[1]] + [int(df["Year"].max()) for df in deltas.values() if len(df)])
+        self.year_window = (self.year_window[0], last)
+        if "death_df" in deltas:
+            self._warn_outside(deltas["death_df"], self.year_window, death_path, "are kept but have no population to join")
+        if "pop_df" in deltas:
+            pop = deltas["pop_df"]
+            deltas["pop_df"] = pop[~self._warn_outside(pop, self.year_window, pop_path, "are dropped")].reset_index(drop=True)
+        if "alcohol_df" in deltas:
+            alcohol = deltas["alcohol_df"]
+            window = alcohol_years(self.year_window)
+            deltas["alcohol_df"] = alcohol[~self._warn_outside(alcohol, window, alcohol_path, "are dropped")].reset_index(drop=True)
+        deltas = {name: delta for name, delta in deltas.items() if len(delta)}
+        if not deltas:
+            return {}
+
+        # Country dimension over the known names plus the new ones
+        old_dim = self.country_dim
+        dim, aliases, unmatched = build_country_dimension(self._country_sources(deltas), reference="population")
+        ids_changed = not dim.equals(old_dim)
+        self.country_dim, self.country_aliases, self.unmatched_countries = dim, aliases, unmatched
+        for name, delta in deltas.items():
+            attach_country_ids(delta, dim)
+            deltas[name] = sort_rows(delta, name)
+        if ids_changed:
+            for name in ("pop_df", "death_df", "alcohol_df", "pop_total_df"):
+                table = getattr(self, name)
+                for col in ("country", "iso3"):
+                    table[col] = table[col].astype(object)
+                attach_country_ids(table, dim)
+            # Factors keep their values, only the ids of their countries move
+            new_ids = old_dim.set_index("country_id")["iso3"].map(dim.set_index("iso3")["country_id"])
+            self.adjustment_df["country_id"] = self.adjustment_df["country_id"].map(new_ids).astype(np.int64)
+            self.adjustment_df = sort_rows(self.adjustment_df, "adjustment_df")
+
+        # Continents of names not seen before
+        named = list(deltas.values()) + ([self.pop_df, self.death_df] if ids_changed else [])
+        names = pd.unique(pd.concat([df["country"].astype(str) for df in named]))
+        new_names = [n for n in names if n not in self.continent_lookup.index]
+        if new_names:
+            self.continent_lookup = pd.concat([self.continent_lookup, self._build_continent_lookup(new_names)]).sort_index()
+        if ids_changed:
+            self._map_continents(self.pop_df)
+            self._map_continents(self.pop_total_df)
+            self.pop_total_df = sort_rows(self.pop_total_df, "pop_total_df")
+        if "pop_df" in deltas:
+            self._map_continents(deltas["pop_df"])
+
+        # Replace the source partitions
+        stats = {}
+        for name, delta in deltas.items():
+            partitions = pd.MultiIndex.from_arrays([delta["country"].astype(str).to_numpy(),
+                                                    delta["Year"].to_numpy(dtype=np.int64)]).unique()
+            table = getattr(self, name)
+            kept = table[~in_partitions(table, partitions)]
+            setattr(self, name, merge_sorted(kept, sort_rows(self._conform(delta, table), name), name))
+            stats[name] = len(partitions)
+        if "death_df" in deltas:
+            self.cause_list = sorted(set(self.cause_list) | set(deltas["death_df"]["Cause"].unique()))
+
+        # Population totals and adjustment factors change only where the population did, and are
+        # summed from the float64 delta rows, never from a compact float32 pop_df
+        if "pop_df" in deltas:
+            pop = deltas["pop_df"]
+            pop_keys = country_year_keys(pop[pop["country_id"] >= 0]).unique()
+            totals = self._map_continents(population_totals(pop))
+            kept = self.pop_total_df[~country_year_keys(self.pop_total_df).isin(pop_keys)]
+            self.pop_total_df = merge_sorted(kept, sort_rows(self._conform(totals, self.pop_total_df), "pop_total_df"), "pop_total_df")
+            if self.age_standard is not None:
+                weights = self._standard_weights()
+                factors = adjustment_factors(pop, self.age_standard, weights=weights).reset_index()
+                kept = self.adjustment_df[~country_year_keys(self.adjustment_df).isin(pop_keys)]
+                self.adjustment_df = merge_sorted(kept, sort_rows(factors, "adjustment_df"), "adjustment_df")
+
+        # A population standard year that changed moves every factor
+        restandardize = (self.age_standard not in (None, "who") and "pop_df" in deltas
+                         and int(self.age_standard) in set(deltas["pop_df"]["Year"].astype(int)))
+        if restandardize:
+            self.adjustment_df = adjustment_factors(self._float64(self.pop_df), self.age_standard).reset_index()
+
+        # Country-years whose merged rows change
+        changed = [self.death_df, self.pop_df] if ids_changed else list(deltas.values())
+        keys = pd.concat([df.loc[df["country_id"] >= 0, ["country_id", "Year"]] for df in changed])
+        affected = pd.MultiIndex.from_frame(keys.astype(np.int64).drop_duplicates())
+
+        deaths = self.death_df[country_year_keys(self.death_df).isin(affected)]
+        alcohol = self.alcohol_df[country_year_keys(self.alcohol_df).isin(affected)]
+        merged = merge_partition(deaths, self.pop_total_df[country_year_keys(self.pop_total_df).isin(affected)], alcohol)
+        if self.age_standard is not None:
+            merged[MODEL_ADJUSTED_RATE] = adjusted_rates(merged, self._factors(), country_year_keys(merged))
+        merged = self._map_continents(merged)
+        kept = self._unaffected(self.merged_df, affected, ids_changed)
+        self.merged_df = merge_sorted(kept, sort_rows(self._conform(merged, self.merged_df), "merged_df"), "merged_df")
+
+        if restandardize:
+            rates = adjusted_rates(self.merged_df, self._factors(), country_year_keys(self.merged_df))
+            self.merged_df[MODEL_ADJUSTED_RATE] = rates.astype(self.merged_df[MODEL_ADJUSTED_RATE].dtype)
+
+        if self.compact and not self._is_compact():
+            self._compact_dtypes()
+        stats["country_years"] = len(affected)
+        return stats
+
+    @staticmethod
+    def _warn_outside(df, window, path, consequence):
+        # Boolean mask of the delta rows before the start of the year window, with a warning if there are any
+        outside = (df["Year"] < window[0]).to_numpy()
+        if outside.any():
+            years = sorted(set(df.loc[outside, "Year"].astype(int)))
+            warnings.warn(f"{outside.sum()} rows of {path} (years {years[0]}-{years[-1]}) are before the year window "
+                          f"{window[0]}-{window[1]} and {consequence}; pass years= to DataPreparation to widen it",
+                          stacklevel=4)
+        return outside
+
+    @staticmethod
+    def _float64(pop_df):
+        return pop_df.astype({col: np.float64 for col in ("Population_Male", "Population_Female", "Population_Total")})
+
+    def _standard_weights(self):
+        # A standard year only needs that year's rows of pop_df, the WHO standard none
+        if self.age_standard == "who":
+            return standard_weights(None, "who")
+        year = self.pop_df[self.pop_df["Year"] == int(self.age_standard)]
+        return standard_weights(self._float64(year), self.age_standard)
+
+    def _factors(self):
+        # adjustment_df indexed like the output of adjustment_factors
+        return self.adjustment_df.set_index(["country_id", "Year"])
+
+    @staticmethod
+    def _unaffected(table, affected, ids_changed):
+        # Rows of a derived table that stay; all are rebuilt when the country ids moved
+        if ids_changed:
+            return table.iloc[0:0]
+        return table[~country_year_keys(table).isin(affected)]
+
+    def _conform(self, rows, like):
+        # New rows with the dtypes of the table they join, where their values fit
+        if not self.compact:
+            return rows
+        rows = rows.copy()
+        for col, dtype in like.dtypes.items():
+            if col not in rows.columns:
+                continue
+            if isinstance(dtype, pd.CategoricalDtype):
+                if rows[col].dropna().isin(dtype.categories).all():
+                    rows[col] = rows[col].astype(dtype)
+            elif col == "Year" or col in COMPACT_FLOAT_COLUMNS:
+                rows[col] = rows[col].astype(dtype)
+        return rows
+
+    def _is_compact(self):
+        # Whether every key column of the long tables is still categorical
+        tables = ["death_df", "merged_df", "pop_df", "pop_total_df", "alcohol_df"]
+        keys = ["country", "iso3", "Cause", "Continent", "Age_Group"]
+        return all(isinstance(getattr(self, name)[col].dtype, pd.CategoricalDtype)
+                   for name in tables for col in keys if col in getattr(self, name).columns)
+
+    def _load_sources_parallel(self, death_path, pop_path, alcohol_path):
+        # The three sources are independent; pandas parsing releases the GIL for most of the work
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            deaths = pool.submit(lambda: prep_deaths(pd.read_csv(death_path)))
+            population = pool.submit(load_population, pop_path, self.years)
+            alcohol = pool.submit(lambda: prep_alcohol(pd.read_csv(alcohol_path), alcohol_years(self.years)))
+            self.death_df = deaths.result()
+            pop_df, self.pop_load_stats = population.result()
+            self.pop_df = prep_population(pop_df)
+            self.alcohol_df = alcohol.result()
+        self.cause_list = sorted(self.death_df["Cause"].unique().tolist())
 
     def _preprocess_all(self):
-        self._prep_population()
-        self._prep_deaths()
-        self._prep_alcohol()
+        # Sources are loaded and prepared (_prep_population, _prep_deaths, _prep_alcohol) at this point
+        self._build_countries()
+        self._build_population_totals()
         self._merge_data()
+        self._add_model_adjusted_rates()
         self._add_continents()
+        if self.compact:
+            self._compact_dtypes()
+
+    def report_load_stats(self):
+        stats = self.pop_load_stats
+        if self.loaded_from_cache:
+            print(f"Prepared data loaded from cache {self.cache_key}")
+        if not stats:
+            return
+        share = stats["rows_kept"] / stats["rows_read"] * 100 if stats["rows_read"] else 0.0
+        print(f"Population rows read: {stats['rows_read']:,}, kept: {stats['rows_kept']:,} ({share:.1f}%)")
+
+    def report_country_coverage(self):
+        """Print how many names of each source joined through ISO3 and list the ones that did not."""
+        print(f"=== COUNTRY COVERAGE ({len(self.country_dim)} ISO3 codes) ===")
+        for source, names in self.country_aliases.groupby("source", sort=False):
+            matched = (names["country_id"] >= 0) & ~names["name"].isin(
+                self.unmatched_countries.loc[self.unmatched_countries["source"] == source, "name"])
+            print(f"{source}: {matched.sum()} of {len(names)} names matched")
+        if not self.unmatched_countries.empty:
+            print(self.unmatched_countries.to_string(index=False))
+
+    def _build_query_index(self):
+        # merged_df sorted by (Cause, Year, country) so every (cause, year) group is one contiguous block
+        df = self.merged_df.sort_values(["Cause", "Year", "country"], kind="mergesort").reset_index(drop=True)
+        groups = df.groupby(["Cause", "Year"], sort=False, observed=True).indices
+        self._query_offsets = {key: (rows[0], rows[-1] + 1) for key, rows in groups.items()}
+        self._query_country_rows = df.groupby("country", sort=False, observed=True).indices
+        self._query_year_rows = df.groupby("Year", sort=False, observed=True).indices
+        self._query_continent_rows = df.groupby("Continent", sort=False, observed=True).indices
+        self._query_years = sorted(df["Year"].unique().tolist())
+        self._query_df = df
+
+    def query(self, cause=None, year=None, continent=None, country=None, years=None):
+        """
+        Select rows of merged_df without scanning the whole table.
+
+        A (cause, year) lookup returns a slice of a sorted copy of merged_df
+        through a precomputed offset index; country, year and continent
+        lookups use precomputed row positions. Remaining filters only touch
+        the selected rows.
+
+        Parameters:
+        -----------
+        cause, year, continent, country : optional
+            Exact values to select.
+        years : iterable of int, optional
+            Several years at once, ignored when year is given.
+        """
+        if self._query_df is None:
+            self._build_query_index()
+        df = self._query_df
+
+        if year is not None:
+            years = [year]
+
+        if cause is not None:
+            parts = []
+            for y in (years if years is not None else self._query_years):
+                bounds = self._query_offsets.get((cause, y))
+                if bounds is not None:
+                    parts.append(df.iloc[bounds[0]:bounds[1]])
+            if not parts:
+                out = df.iloc[0:0]
+            elif len(parts) == 1:
+                out = parts[0]
+            else:
+                out = pd.concat(parts)
+            if country is not None:
+                out = out[out["country"] == country]
+        elif country is not None:
+            out = df.iloc[self._query_country_rows.get(country, [])]
+            if years is not None:
+                out = out[out["Year"].isin(years)]
+        elif years is not None:
+            rows = [self._query_year_rows.get(y) for y in set(years)]
+            rows = [r for r in rows if r is not None]
+            out = df.iloc[np.sort(np.concatenate(rows))] if rows else df.iloc[0:0]
+        elif continent is not None:
+            out = df.iloc[self._query_continent_rows.get(continent, [])]
+            continent = None
+        else:
+            out = df
+
+        if continent is not None:
+            out = out[out["Continent"] == continent]
+        return out
 
     def _prep_population(self):
-        df = self.pop_df
-        df = df[(df["Variant"] == "Medium") & (df["Time"].between(1990, 2019))]
-        df = df[df["LocTypeID"] == 4]
-    
-        df = df[["Location", "Time", "AgeGrp", "PopMale", "PopFemale", "PopTotal"]].copy()
-        df.rename(columns={
-            "Location": "country",
-            "Time": "Year",
-            "AgeGrp": "Age_Group",
-            "PopMale": "Population_Male",
-            "PopFemale": "Population_Female",
-            "PopTotal": "Population_Total"
-        }, inplace=True)
-    
-        df["Population_Male"] *= 1000
-        df["Population_Female"] *= 1000
-        df["Population_Total"] *= 1000
-    
-        self.pop_df = df
+        self.pop_df = prep_population(self.pop_df)
 
     def _prep_deaths(self):
-        df = self.death_df.rename(columns={"Country/Territory": "country"}).copy()
-        cause_cols = df.columns.difference(["country", "Year", "Code"])
-        df = df.melt(
-            id_vars=["country", "Year"],
-            value_vars=cause_cols,
-            var_name="Cause",
-            value_name="Deaths"
-        )
-        df["Deaths"] = pd.to_numeric(df["Deaths"], errors="coerce")
-        self.death_df = df
-        self.cause_list = sorted(df["Cause"].unique().tolist())
+        self.death_df = prep_deaths(self.death_df)
+        self.cause_list = sorted(self.death_df["Cause"].unique().tolist())
 
     def _prep_alcohol(self):
-        df = self.alcohol_df
-        df = df[(df["Year"] >= 2000) & (df["Year"] <= 2019)]
-        df = df.rename(columns={
-            "Entity": "country",
-            "Total alcohol consumption per capita (liters of pure alcohol, projected estimates, 15+ years of age)": "Alcohol_Consumption_Liters"
-        })
-        df = df[["country", "Year", "Alcohol_Consumption_Liters"]]
-        df = df.groupby(["country", "Year"]).mean().reset_index()
-        self.alcohol_df = df
+        self.alcohol_df = prep_alcohol(self.alcohol_df, alcohol_years(self.years))
+
+    def _country_sources(self, deltas=None):
+        """
+        Names and ISO3 codes per source for build_country_dimension, sorted so
+        the dimension does not depend on row order. With deltas, the names
+        already in country_aliases are combined with those of the new rows.
+        """
+        tables = {"population": "pop_df", "deaths": "death_df", "alcohol": "alcohol_df"}
+        sources = {}
+        for source, table in tables.items():
+            if deltas is None:
+                parts = [getattr(self, table)[["country", "iso3"]].rename(columns={"country": "name"})]
+            else:
+                parts = [self.country_aliases.loc[self.country_aliases["source"] == source, ["name", "iso3"]]]
+                if table in deltas:
+                    parts.append(deltas[table][["country", "iso3"]].rename(columns={"country": "name"}))
+            part = pd.concat(parts, ignore_index=True)
+            part["name"] = part["name"].astype(str)
+            part = part.drop_duplicates()
+            sources[source] = part.sort_values(["name", "iso3"], kind="mergesort").reset_index(drop=True)
+        return sources
+
+    def _build_countries(self):
+        # Canonical ISO3 -> country_id table; population names are the canonical ones
+        self.country_dim, self.country_aliases, self.unmatched_countries = build_country_dimension(
+            self._country_sources(), reference="population"
+        )
+        for name in ("pop_df", "death_df", "alcohol_df"):
+            attach_country_ids(getattr(self, name), self.country_dim)
+            setattr(self, name, sort_rows(getattr(self, name), name))
+
+    def _build_population_totals(self):
+        self.pop_total_df = population_totals(self.pop_df)
 
     def _merge_data(self):
-        merged = self.death_df.merge(self.pop_df, on=["country", "Year"], how="left")
-        merged = merged[merged["Population_Total"].notna() & (merged["Population_Total"] > 0)]
-        merged["Death_Rate_per_100k"] = (merged["Deaths"] / merged["Population_Total"]) * 100000
-        merged = merged.merge(self.alcohol_df, on=["country", "Year"], how="left")
-        self.merged_df = merged
+        if self.workers > 1:
+            merged = merge_partitioned(self.death_df, self.pop_total_df, self.alcohol_df, self.workers)
+        else:
+            merged = merge_partition(self.death_df, self.pop_total_df, self.alcohol_df)
+        self.merged_df = sort_rows(merged, "merged_df")
+
+    def _add_model_adjusted_rates(self):
+        # Crude rate times a per country-year and cause-profile factor, see age_standard.py for the model.
+        # The factors are kept (float64) so append can adjust new rows without the full population.
+        if self.age_standard is None:
+            self.adjustment_df = pd.DataFrame({"country_id": pd.Series(dtype=np.int64), "Year": pd.Series(dtype=np.int64)})
+            return
+        factors = adjustment_factors(self.pop_df, self.age_standard)
+        self.adjustment_df = factors.reset_index()
+        self.merged_df[MODEL_ADJUSTED_RATE] = adjusted_rates(self.merged_df, factors, country_year_keys(self.merged_df))
 
     def _get_continent_from_country(self, country):
+        if country in self.manual_continent_map:
+            return self.manual_continent_map[country]
         try:
             code = pc.country_name_to_country_alpha2(country)
             continent_code = pc.country_alpha2_to_continent_code(code)
             return pc.convert_continent_code_to_continent_name(continent_code)
-        except:
-            return self.manual_continent_map.get(country, "Other")
+        except Exception:
+            return "Other"
+
+    def _build_continent_lookup(self, countries):
+        # Resolve each distinct name once, manual_continent_map takes precedence
+        names = pd.unique(pd.Series(countries, dtype="object").dropna())
+        return pd.Series({name: self._get_continent_from_country(name) for name in sorted(names)},
+                         name="Continent", dtype="object").rename_axis("country")
 
     def _add_continents(self):
-        self.merged_df["Continent"] = self.merged_df["country"].apply(self._get_continent_from_country)
-        self.pop_df["Continent"] = self.pop_df["country"].apply(self._get_continent_from_country)
+        self.continent_lookup = self._build_continent_lookup(
+            np.concatenate([self.merged_df["country"].unique(), self.pop_df["country"].unique()])
+        )
+        for name in ("merged_df", "pop_df", "pop_total_df"):
+            self._map_continents(getattr(self, name))
+
+    def _map_continents(self, df):
+        df["Continent"] = df["country"].map(self.continent_lookup)
+        return df
+
+    def _compact_dtypes(self):
+        """
+        Store the long tables with categorical keys, int16 years and float32
+        population and rate columns. pop_total_df keeps float64 populations,
+        so rates computed by append match those of a full build.
+
+        Every table uses the same category order for country, Cause and
+        Continent, so joins between them stay categorical. Memory before and
+        after is kept in memory_report.
+        """
+        tables = ["death_df", "merged_df", "pop_df", "pop_total_df", "alcohol_df"]
+        before = {name: getattr(self, name).memory_usage(deep=True).sum() for name in tables}
+
+        countries = pd.concat([getattr(self, name)["country"] for name in tables]).dropna().unique()
+        categories = {
+            "country": pd.CategoricalDtype(sorted(countries)),
+            "iso3": pd.CategoricalDtype(self.country_dim["iso3"].tolist()),
+            "Cause": pd.CategoricalDtype(self.cause_list),
+            "Continent": pd.CategoricalDtype(sorted(self.continent_lookup.unique())),
+            # Age groups keep their natural order ("0-4", "5-9", ..., "100+")
+            "Age_Group": pd.CategoricalDtype(pd.unique(self.pop_df["Age_Group"]), ordered=True),
+        }
+
+        for name in tables:
+            df = getattr(self, name)
+            for col, dtype in categories.items():
+                if col in df.columns:
+                    df[col] = df[col].astype(dtype)
+            if "Year" in df.columns:
+                df["Year"] = df["Year"].astype("int16")
+            for col in COMPACT_FLOAT_COLUMNS:
+                if col in df.columns and name != "pop_total_df":
+                    df[col] = df[col].astype("float32")
+
+        after = {name: getattr(self, name).memory_usage(deep=True).sum() for name in tables}
+        report = pd.DataFrame({"Before_MB": pd.Series(before), "After_MB": pd.Series(after)}) / 1e6
+        report["Reduction_%"] = (1 - report["After_MB"] / report["Before_MB"]) * 100
+        self.memory_report = report
+
+        print("=== MEMORY (compact dtypes) ===")
+        print(report.round(2))
 
 
 
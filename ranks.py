@@ -0,0 +1,99 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import numpy as np
+import pandas as pd
+
+from trends import WORLD
+
+
+def rank_descending(values):
+    """
+    Rank along the last axis, 1 for the largest value, ties sharing the
+    lowest rank (pandas method="min"). NaN values get rank 0.
+    """
+    ranks = (values[..., None, :] > values[..., :, None]).sum(axis=-1) + 1
+    return np.where(np.isnan(values), 0, ranks)
+
+
+def region_name(continent=None, country=None):
+    """Region name for the continent/country arguments of the plotting functions."""
+    return country or continent or WORLD
+
+
+class RankTable:
+    """
+    Rank of every cause in every year for every country, continent and the world.
+
+    values holds the death rates per 100k summed over a region's countries,
+    shape (regions, years, causes), and ranks the matching int16 ranks (0
+    where there is no data). Regions are the countries, then the continents,
+    then WORLD, and are looked up by name.
+    """
+
+    def __init__(self, values, ranks, regions, years, causes):
+        self.values = values
+        self.ranks = ranks
+        self.regions = list(regions)
+        self.years = [int(y) for y in years]
+        self.causes = list(causes)
+
+        self.region_index = {r: i for i, r in enumerate(self.regions)}
+        self.year_index = {y: i for i, y in enumerate(self.years)}
+
+    @classmethod
+    def from_cube(cls, cube):
+        keep = [cube.continent_index[c] for c in cube.continents if c != "nan"]
+        rates = cube.rates.astype(np.float64)
+
+        # Regions without any country data for a year and cause are missing, not zero
+        onehot = np.eye(len(cube.continents))[cube.continent_codes]
+        valid = (~np.isnan(rates)).reshape(len(cube.countries), -1).astype(np.float64)
+        continent_valid = (onehot.T @ valid).reshape(len(cube.continents), *rates.shape[1:])[keep] > 0
+        continents = np.where(continent_valid, cube.continent_sums()[keep], np.nan)
+        world = np.where(~np.isnan(rates).all(axis=0), cube.region_sum(), np.nan)
+
+        values = np.concatenate([rates, continents, world[None]])
+        ranks = rank_descending(values).astype(np.int16)
+        regions = list(cube.countries) + [cube.continents[i] for i in keep] + [WORLD]
+        return cls(values, ranks, regions, cube.years, cube.causes)
+
+    def has(self, region, *years):
+        return region in self.region_index and all(y in self.year_index for y in years)
+
+    def rates(self, region, year):
+        """Death rate per 100k of every cause, as a Series indexed by cause."""
+        return pd.Series(self.values[self.region_index[region], self.year_index[year]], index=self.causes)
+
+    def rank(self, region, year):
+        """Rank of every cause, as a Series indexed by cause (0 where there is no data)."""
+        return pd.Series(self.ranks[self.region_index[region], self.year_index[year]], index=self.causes)
+
+    def top(self, region, year, n):
+        """The n highest ranked causes, most deadly first."""
+        ranks = self.ranks[self.region_index[region], self.year_index[year]]
+        order = np.argsort(np.where(ranks > 0, ranks, np.iinfo(np.int16).max), kind="stable")
+        return [self.causes[k] for k in order[:n] if ranks[k] > 0]
+
+    def new_entrants(self, region, base_year, target_year, n):
+        """Causes in the top n of target_year that were not in the top n of base_year."""
+        base = set(self.top(region, base_year, n))
+        return [c for c in self.top(region, target_year, n) if c not in base]
+
+    def rank_frame(self, region, years=None):
+        """Ranks of one region as causes x years, for bump and slope charts."""
+        years = years or self.years
+        cols = [self.year_index[y] for y in years]
+        return pd.DataFrame(self.ranks[self.region_index[region]][cols].T, index=pd.Index(self.causes, name="Cause"), columns=years)
+
+    def to_frame(self):
+        """Long table with one row per region, year and cause that has data."""
+        r, y, k = np.nonzero(self.ranks)
+        return pd.DataFrame({
+            "Region": pd.Categorical.from_codes(r, self.regions),
+            "Year": np.array(self.years, dtype=np.int16)[y],
+            "Cause": pd.Categorical.from_codes(k, self.causes),
+            "Rank": self.ranks[r, y, k],
+            "Death Rate per 100k": self.values[r, y, k].astype(np.float32),
+        })
@@ -0,0 +1,138 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+LABELS_FILE = "labels.json"
+
+
+class RateCube:
+    """
+    Dense death rates per 100k indexed by (country, year, cause).
+
+    rates is a float32 array of shape (countries, years, causes) with NaN
+    where there is no data, population has shape (countries, years) and
+    continent_codes maps each country to an index into continents. Saved
+    cubes can be opened with mmap_mode="r", so several processes share the
+    same pages instead of holding private copies.
+    """
+
+    def __init__(self, rates, population, countries, years, causes, continents, continent_codes):
+        self.rates = rates
+        self.population = population
+        self.countries = list(countries)
+        self.years = [int(y) for y in years]
+        self.causes = list(causes)
+        self.continents = list(continents)
+        self.continent_codes = continent_codes
+
+        self.country_index = {c: i for i, c in enumerate(self.countries)}
+        self.year_index = {y: i for i, y in enumerate(self.years)}
+        self.cause_index = {c: i for i, c in enumerate(self.causes)}
+        self.continent_index = {c: i for i, c in enumerate(self.continents)}
+
+    @classmethod
+    def from_frame(cls, merged, value_col="Death_Rate_per_100k"):
+        """Build the cube from a long table such as DataPreparation.merged_df."""
+        country = merged["country"].astype(str)
+        cause = merged["Cause"].astype(str)
+        year = merged["Year"].to_numpy().astype(np.int64)
+
+        countries = np.sort(country.unique())
+        years = np.unique(year)
+        causes = np.sort(cause.unique())
+
+        ci = pd.Categorical(country, categories=countries).codes
+        yi = np.searchsorted(years, year)
+        ki = pd.Categorical(cause, categories=causes).codes
+
+        rates = np.full((len(countries), len(years), len(causes)), np.nan, dtype=np.float32)
+        rates[ci, yi, ki] = merged[value_col].to_numpy(dtype=np.float32)
+
+        population = np.full((len(countries), len(years)), np.nan, dtype=np.float32)
+        population[ci, yi] = merged["Population_Total"].to_numpy(dtype=np.float32)
+
+        per_country = pd.Series(merged["Continent"].astype(str).to_numpy(), index=country.to_numpy())
+        per_country = per_country[~per_country.index.duplicated()].reindex(countries)
+        continents = np.sort(per_country.unique())
+        continent_codes = pd.Categorical(per_country, categories=continents).codes.astype(np.int16)
+
+        return cls(rates, population, countries, years, causes, continents, continent_codes)
+
+    def save(self, directory):
+        """
+        Write the cube to directory. The files go to a temporary directory
+        that is renamed into place, so another process never finds (exists)
+        or memory-maps a half-written cube. If another process saved the
+        same cube first, its copy is kept.
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=f".{os.path.basename(directory)}-", dir=parent)
+        try:
+            np.save(os.path.join(tmp, "rates.npy"), self.rates)
+            np.save(os.path.join(tmp, "population.npy"), self.population)
+            np.save(os.path.join(tmp, "continent_codes.npy"), self.continent_codes)
+            labels = {
+                "countries": self.countries,
+                "years": self.years,
+                "causes": self.causes,
+                "continents": self.continents,
+            }
+            with open(os.path.join(tmp, LABELS_FILE), "w", encoding="utf-8") as f:
+                json.dump(labels, f)
+            if self.exists(directory):
+                return
+            # A leftover directory without labels is incomplete
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(tmp, directory)
+        except OSError:
+            # Lost a race with another writer; a complete cube is in place
+            if not self.exists(directory):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        with open(os.path.join(directory, LABELS_FILE), encoding="utf-8") as f:
+            labels = json.load(f)
+        return cls(
+            np.load(os.path.join(directory, "rates.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, "population.npy"), mmap_mode=mmap_mode),
+            labels["countries"],
+            labels["years"],
+            labels["causes"],
+            labels["continents"],
+            np.load(os.path.join(directory, "continent_codes.npy")),
+        )
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, LABELS_FILE))
+
+    def country_mask(self, continent=None):
+        if continent is None:
+            return np.ones(len(self.countries), dtype=bool)
+        return self.continent_codes == self.continent_index[continent]
+
+    def region_sum(self, continent=None):
+        """Rates summed over the countries of a continent (or the world), shape (years, causes)."""
+        return np.nansum(self.rates[self.country_mask(continent)], axis=0, dtype=np.float64)
+
+    def continent_sums(self):
+        """region_sum for every continent at once, shape (continents, years, causes)."""
+        onehot = np.eye(len(self.continents), dtype=np.float64)[self.continent_codes]
+        flat = np.nan_to_num(self.rates, nan=0.0).reshape(len(self.countries), -1)
+        return (onehot.T @ flat).reshape(len(self.continents), len(self.years), len(self.causes))
+
+    def to_frame(self, values, index_name="Cause"):
+        """Wrap a (years, causes) array as a DataFrame with causes as rows and years as columns."""
+        return pd.DataFrame(np.asarray(values).T, index=pd.Index(self.causes, name=index_name), columns=self.years)
@@ -0,0 +1,97 @@
+"""
+Copyright C Philipp Mc Guire, 2025
+Lincensed under GPL V3.0 https://www.fsf.org/licensing/licenses/gpl-3.0.html
+"""
+import numpy as np
+import pandas as pd
+
+ALL_CAUSES = "All Causes"
+WORLD = "Worldwide"
+
+
+def region_series(cube):
+    """
+    Death rate per 100k over the years for every country, continent and the
+    world, for every cause plus ALL_CAUSES.
+
+    Country series are read from the cube. Continent and world series are
+    pooled: deaths summed over their countries divided by the population of
+    the countries with data. ALL_CAUSES sums the causes before pooling and
+    is NaN for a country-year where any cause has no rate, so it is never a
+    partial total (under a rate column that leaves some causes NaN, such as
+    the model-adjusted rate, it is NaN throughout).
+
+    Returns:
+    --------
+    (labels, values)
+        labels is a DataFrame with columns Level, Region and Cause, one row
+        per series; values has shape (series, years).
+    """
+    rates = cube.rates.astype(np.float64)
+    all_causes = rates.sum(axis=2, keepdims=True)
+    rates = np.concatenate([rates, all_causes], axis=2)
+    causes = cube.causes + [ALL_CAUSES]
+
+    pop = np.nan_to_num(cube.population.astype(np.float64))[:, :, None]
+    valid = ~np.isnan(rates)
+    deaths = np.where(valid, rates * pop, 0.0)
+    weights = np.where(valid, pop, 0.0)
+
+    # Country -> region membership: one row per continent, then the world
+    continents = [c for c in cube.continents if c != "nan"]
+    groups = np.array([cube.continent_codes == cube.continent_index[c] for c in continents]
+                      + [np.ones(len(cube.countries), dtype=bool)], dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pooled = np.tensordot(groups, deaths, axes=1) / np.tensordot(groups, weights, axes=1)
+
+    regions = [("country", c) for c in cube.countries] + [("continent", c) for c in continents] + [("world", WORLD)]
+    values = np.concatenate([rates, pooled]).transpose(0, 2, 1).reshape(-1, len(cube.years))
+    labels = pd.DataFrame({
+        "Level": np.repeat([level for level, _ in regions], len(causes)),
+        "Region": np.repeat([name for _, name in regions], len(causes)),
+        "Cause": np.tile(causes, len(regions)),
+    })
+    return labels, values
+
+
+def fit_lines(values, years):
+    """
+    Least-squares line through every row of values against years, ignoring NaN.
+
+    Returns a dict of arrays with one entry per row: Slope, Intercept,
+    Pct_per_Year (slope relative to the first observed value), R2 and Years
+    (number of observed points). Rows with fewer than two points are NaN.
+    """
+    years = np.asarray(years, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    x = np.where(valid, years - years.mean(), 0.0)
+    y = np.where(valid, values, 0.0)
+
+    n = valid.sum(axis=-1).astype(np.float64)
+    sx, sy = x.sum(axis=-1), y.sum(axis=-1)
+    sxx, syy, sxy = (x * x).sum(axis=-1), (y * y).sum(axis=-1), (x * y).sum(axis=-1)
+    cov = n * sxy - sx * sy
+    var_x = n * sxx - sx ** 2
+    var_y = n * syy - sy ** 2
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = cov / var_x
+        intercept = (sy - slope * sx) / n - slope * years.mean()
+        r2 = np.where(var_y > 0, cov ** 2 / (var_x * var_y), 1.0)
+        first = np.take_along_axis(values, valid.argmax(axis=-1)[..., None], axis=-1)[..., 0]
+        pct = slope / first * 100
+
+    enough = n >= 2
+    return {
+        "Slope": np.where(enough, slope, np.nan),
+        "Intercept": np.where(enough, intercept, np.nan),
+        "Pct_per_Year": np.where(enough, pct, np.nan),
+        "R2": np.where(enough, r2, np.nan),
+        "Years": n.astype(np.int64),
+    }
+
+
+def trend_table(labels, values, years):
+    """Tidy table of fit_lines for every series of region_series."""
+    return pd.concat([labels, pd.DataFrame(fit_lines(values, years))], axis=1)